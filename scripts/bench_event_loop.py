@@ -0,0 +1,64 @@
+"""
+Benchmark of the event loops the server can run on. Local clients
+exchange AO-sized messages with an echo server over TCP, the way the
+server's connections do.
+
+Usage: python scripts/bench_event_loop.py [clients] [messages]
+"""
+
+import asyncio
+import sys
+import time
+
+MESSAGE = b'MS#chat#-#Phoenix#normal#Hold it!#def#1#0#1#0#0#0#0#0#0#%'
+
+
+class Echo(asyncio.Protocol):
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def data_received(self, data):
+		self.transport.write(data)
+
+
+async def client(port, messages):
+	reader, writer = await asyncio.open_connection('127.0.0.1', port)
+	for _ in range(messages):
+		writer.write(MESSAGE)
+		await reader.readexactly(len(MESSAGE))
+	writer.close()
+	await writer.wait_closed()
+
+
+async def bench(clients, messages):
+	loop = asyncio.get_running_loop()
+	server = await loop.create_server(Echo, '127.0.0.1', 0)
+	port = server.sockets[0].getsockname()[1]
+	start = time.perf_counter()
+	await asyncio.gather(*(client(port, messages) for _ in range(clients)))
+	elapsed = time.perf_counter() - start
+	server.close()
+	await server.wait_closed()
+	return elapsed
+
+
+def main():
+	clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+	messages = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+	policies = [('asyncio', asyncio.DefaultEventLoopPolicy)]
+	try:
+		import uvloop
+		policies.append(('uvloop', uvloop.EventLoopPolicy))
+	except ImportError:
+		print('uvloop is not installed, only benchmarking asyncio')
+
+	total = clients * messages
+	for name, policy in policies:
+		asyncio.set_event_loop_policy(policy())
+		elapsed = asyncio.run(bench(clients, messages))
+		print(f'{name:8} {total / elapsed:10.0f} round trips/s')
+	asyncio.set_event_loop_policy(None)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,70 @@
+"""
+Benchmark of the compiled IP range ban list against the linear scan it
+replaced, on a generated ban list.
+
+Usage: python scripts/bench_iprange_bans.py [entries] [lookups]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server.ip_ranges import IPRangeBans
+
+
+def legacy_match(lines, address, asn):
+	"""The linear scan new_client used to run."""
+	for line, entry in enumerate(lines):
+		if entry != '' and address.startswith(entry) or asn == entry:
+			return line
+	return None
+
+
+def generate(rng, entries):
+	"""Make a ban list of prefixes, CIDR ranges and ASNs."""
+	lines = []
+	for _ in range(entries):
+		kind = rng.random()
+		octets = [str(rng.randrange(256)) for _ in range(4)]
+		if kind < 0.5:
+			lines.append('.'.join(octets[:rng.randrange(2, 4)]) + '.')
+		elif kind < 0.8:
+			length = rng.choice([16, 20, 24, 28])
+			lines.append('.'.join(octets) + f'/{length}')
+		else:
+			lines.append(str(rng.randrange(1, 400000)))
+	return lines
+
+
+def main():
+	entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+	rng = random.Random(0)
+	lines = generate(rng, entries)
+	clients = [('.'.join(str(rng.randrange(256)) for _ in range(4)),
+		str(rng.randrange(1, 400000))) for _ in range(lookups)]
+
+	start = time.perf_counter()
+	bans = IPRangeBans(lines)
+	compiled = time.perf_counter() - start
+
+	start = time.perf_counter()
+	for address, asn in clients:
+		legacy_match(lines, address, asn)
+	legacy = (time.perf_counter() - start) / lookups
+
+	start = time.perf_counter()
+	for address, asn in clients:
+		bans.match(address, asn)
+	matcher = (time.perf_counter() - start) / lookups
+
+	print(f'{entries} entries compiled in {compiled * 1000:.0f} ms')
+	print(f'linear scan {legacy * 1e6:10.1f} us/connection')
+	print(f'matcher     {matcher * 1e6:10.1f} us/connection')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,68 @@
+"""
+Benchmark of the player ID allocator against the list scan it replaced,
+under connect/disconnect churn on a nearly full server.
+
+Usage: python scripts/bench_player_ids.py [playerlimit] [operations]
+"""
+
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server.client_manager import ClientManager
+
+
+class LegacyAllocator:
+	"""The list-based allocation new_client used to run."""
+
+	def __init__(self, playerlimit):
+		self.available_ids = [i for i in range(playerlimit)]
+		self.all_ids = [i for i in range(playerlimit)]
+
+	def allocate_id(self):
+		for id in self.all_ids:
+			if id in self.available_ids:
+				self.available_ids.remove(id)
+				return id
+		return None
+
+	def release_id(self, user_id):
+		if user_id not in self.available_ids:
+			self.available_ids.append(user_id)
+
+
+def churn(allocator, playerlimit, operations, seed=0):
+	"""Fill the server to 90%, then connect and disconnect at random."""
+	rng = random.Random(seed)
+	connected = [allocator.allocate_id() for _ in range(playerlimit * 9 // 10)]
+	start = time.perf_counter()
+	for _ in range(operations):
+		if connected and rng.random() < 0.5:
+			allocator.release_id(connected.pop(rng.randrange(len(connected))))
+		else:
+			user_id = allocator.allocate_id()
+			if user_id is not None:
+				connected.append(user_id)
+	return time.perf_counter() - start, sorted(connected)
+
+
+def main():
+	playerlimit = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	operations = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+	server = types.SimpleNamespace(config={'playerlimit': playerlimit})
+
+	legacy, legacy_ids = churn(LegacyAllocator(playerlimit), playerlimit, operations)
+	heap, heap_ids = churn(ClientManager(server), playerlimit, operations)
+	assert legacy_ids == heap_ids
+
+	print(f'playerlimit {playerlimit}, {operations} connects/disconnects')
+	print(f'list scan {legacy / operations * 1e6:10.2f} us/operation')
+	print(f'heap      {heap / operations * 1e6:10.2f} us/operation')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,66 @@
+"""
+Microbenchmark of the IC message text pipeline against the per-message
+regex path it replaced.
+
+Usage: python scripts/bench_text_pipeline.py [iterations]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server.text_pipeline import TextPipeline
+
+ZALGO_TOLERANCE = 3
+MESSAGES = [
+	'Objection! The witness is clearly lying about the time of the murder.',
+	'(( brb getting coffee ))',
+	'Z̷̢̛a̶̡͝l̸̨̛g̵̢͠o̶̧͝ ̷̨̛t̶̢͝e̸̡̛x̵̧͠t̶̨͝ is still {readable} ~~ish~~',
+	'   ',
+	'ok',
+]
+
+
+def legacy(text, disemvowel):
+	"""The steps net_cmd_ms used to run on every IC message."""
+	len(re.sub(r'[{}\\`|(~~)]', '', text).replace(' ', '')) < 3
+	msg = re.sub('([\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]' +
+				 '{' + re.escape(str(ZALGO_TOLERANCE)) + ',})', '', text)[:256]
+	if disemvowel:
+		msg = re.sub('[aeiou]', '', msg, flags=re.IGNORECASE)
+		msg = re.sub(r'\s+', ' ', msg)
+	if msg.lstrip().startswith('(('):
+		msg = msg.lstrip()
+		msg = msg.replace('((', '')
+	return msg
+
+
+def pipelined(pipeline, text, disemvowel):
+	pipeline.is_spammy(text)
+	msg = pipeline.process(text, limit=256, disemvowel=disemvowel)
+	stripped = msg.lstrip()
+	if stripped.startswith('(('):
+		msg = stripped.replace('((', '')
+	return msg
+
+
+def main():
+	iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	pipeline = TextPipeline(ZALGO_TOLERANCE)
+	for disemvowel in (False, True):
+		for text in MESSAGES:
+			assert legacy(text, disemvowel) == pipelined(pipeline, text, disemvowel)
+		old = timeit.timeit(lambda: [legacy(t, disemvowel) for t in MESSAGES],
+			number=iterations)
+		new = timeit.timeit(lambda: [pipelined(pipeline, t, disemvowel) for t in MESSAGES],
+			number=iterations)
+		count = iterations * len(MESSAGES)
+		print(f'disemvowel={disemvowel}: legacy {old / count * 1e6:.2f} us/msg, '
+			  f'pipeline {new / count * 1e6:.2f} us/msg ({old / new:.1f}x)')
+
+
+if __name__ == '__main__':
+	main()
@@ -30,7 +30,10 @@ from typing import List
 
 from server import database
 from server.evidence import EvidenceList
+from server.music_catalog import MusicCatalog
 from server.exceptions import AreaError
+from server.network.packet import Packet
+from server.timer_wheel import timers
 
 
 class AreaManager:
@@ -70,6 +73,15 @@ class AreaManager:
 			self.cur_subid = 1
 			self.iniswap_allowed = iniswap_allowed
 			self.clients = set()
+			# Number of clients in the area on each character ID
+			self.char_occupancy = {}
+			# CharsCheck list, its packet and the free character IDs, built
+			# when first needed after a character was taken or freed
+			self._chars_check = None
+			self._chars_check_packet = None
+			self._free_char_ids = None
+			# Clients counted towards the ARUP player count
+			self.visible_clients = set()
 			self.invite_list = {}
 			self.id = area_id
 			self.name = name
@@ -99,6 +111,7 @@ class AreaManager:
 			self.music_looper = None
 			self.cards = dict()
 			self.custom_list = dict()
+			self.cmusic_catalog = MusicCatalog(custom=True)
 			self.cmusic_list = []
 			self.cmusic_listname = ''
 			self.hidden = False
@@ -129,9 +142,31 @@ class AreaManager:
 			SPECTATABLE = 2,
 			LOCKED = 3
 
+		@property
+		def cmusic_list(self):
+			"""The custom music list of the area."""
+			return self._cmusic_list
+
+		@cmusic_list.setter
+		def cmusic_list(self, value):
+			self._cmusic_list = value
+			self.cmusic_catalog.compile(value)
+
+		def update_cmusic_catalogs(self):
+			"""
+			Recompile the custom music catalog after the custom music list
+			was changed in place, in every area of the hub sharing the list.
+			"""
+			hub = self.hub if self.sub and self.hub is not None else self
+			for area in [hub] + hub.subareas:
+				if area.cmusic_list is self.cmusic_list:
+					area.cmusic_catalog.compile(area.cmusic_list)
+
 		def new_client(self, client):
 			"""Add a client to the area."""
 			self.clients.add(client)
+			self.occupy_char(client.char_id, 1)
+			self.update_visible(client)
 			lobby = self.server.area_manager.default_area()
 			if self == lobby:
 				for area in self.server.area_manager.areas:
@@ -183,6 +218,8 @@ class AreaManager:
 		def remove_client(self, client):
 			"""Remove a disconnected client from the area."""
 			self.clients.remove(client)
+			self.occupy_char(client.char_id, -1)
+			self.update_visible(client)
 			if self.sub:
 				for othersub in self.hub.subareas:
 					if othersub.is_restricted:
@@ -198,6 +235,21 @@ class AreaManager:
 			if client.char_id != -1:
 				database.log_room('area.leave', client, self)
 
+		def update_visible(self, client):
+			"""
+			Recount a client towards the player count of the area after
+			it joined, left, or changed its ghost or hidden state.
+			:param client: client to recount
+			"""
+			visible = client in self.clients and not client.ghost and not client.hidden
+			if visible == (client in self.visible_clients):
+				return
+			if visible:
+				self.visible_clients.add(client)
+			else:
+				self.visible_clients.discard(client)
+			self.server.area_manager.send_arup_players()
+
 		def unlock(self):
 			"""Mark the area as unlocked."""
 			self.is_locked = self.Locked.FREE
@@ -257,40 +309,81 @@ class AreaManager:
 				self.server.area_manager.send_arup_lock()
 			self.broadcast_ooc('This area is spectatable now.')
 
+		def occupy_char(self, char_id, delta):
+			"""
+			Count clients of the area onto or off a character. The cached
+			CharsCheck is dropped if the character was taken or freed.
+			:param char_id: character ID
+			:param delta: number of clients added (or removed, if negative)
+			"""
+			count = self.char_occupancy.get(char_id, 0)
+			if count + delta > 0:
+				self.char_occupancy[char_id] = count + delta
+			else:
+				self.char_occupancy.pop(char_id, None)
+			if (count > 0) != (count + delta > 0):
+				self._chars_check = None
+
+		def move_char(self, old_char_id, new_char_id):
+			"""
+			Recount a client of the area that changed characters.
+			:param old_char_id: previous character ID
+			:param new_char_id: new character ID
+			"""
+			if old_char_id != new_char_id:
+				self.occupy_char(old_char_id, -1)
+				self.occupy_char(new_char_id, 1)
+
 		def is_char_available(self, char_id):
 			"""
 			Check if a character is available for use.
 			:param char_id: character ID
 			"""
-			return char_id not in [x.char_id for x in self.clients]
+			return char_id not in self.char_occupancy
 
 		def get_rand_avail_char_id(self):
 			"""Get a random available character ID."""
-			avail_set = set(range(len(
-				self.server.char_list))) - {x.char_id
-											for x in self.clients}
-			if len(avail_set) == 0:
+			self.get_chars_check()
+			if self._free_char_ids is None:
+				self._free_char_ids = tuple(char_id for char_id, taken
+					in enumerate(self._chars_check) if not taken)
+			if len(self._free_char_ids) == 0:
 				raise AreaError('No available characters.')
-			return random.choice(tuple(avail_set))
+			return random.choice(self._free_char_ids)
 
 		def send_command(self, cmd, *args):
 			"""
 			Broadcast an AO-compatible command to all clients in the area.
 			"""
+			self.send_packet(Packet(cmd, *args))
+
+		def send_packet(self, packet):
+			"""
+			Broadcast a pre-composed packet to all clients in the area.
+			:param packet: packet to send
+			"""
 			for c in self.clients:
-				c.send_command(cmd, *args)
+				c.send_packet(packet)
 
 		def send_owner_command(self, cmd, *args):
 			"""
 			Send an AO-compatible command to all owners of the area
 			that are not currently in the area.
 			"""
+			self.send_owner_packet(Packet(cmd, *args))
+
+		def send_owner_packet(self, packet):
+			"""
+			Send a pre-composed packet to all owners and spies of the area
+			that are not currently in the area.
+			:param packet: packet to send
+			"""
 			for c in self.owners:
 				if c not in self.clients:
-					c.send_command(cmd, *args)
+					c.send_packet(packet)
 			for spy in self.spies:
 				if spy not in self.clients and spy not in self.owners:
-					spy.send_command(cmd, *args)
+					spy.send_packet(packet)
 
 		def broadcast_ooc(self, msg):
 			"""
@@ -349,7 +442,7 @@ class AreaManager:
 				self.music_looper.cancel()
 			if self.ambiance or name.startswith('/custom'):
 				if length != 0:
-					self.music_looper = asyncio.get_event_loop().call_later(length, lambda: self.play_music(name, -1, length, effects))
+					self.music_looper = timers.call_later(length, lambda: self.play_music(name, -1, length, effects))
 			else:
 				if length != 0:
 					length = 1
@@ -368,7 +461,7 @@ class AreaManager:
 				self.music_looper.cancel()
 			if self.ambiance or name.startswith('/custom'):
 				if length != 0:
-					self.music_looper = asyncio.get_event_loop().call_later(length, lambda: self.play_music(name, -1, length, effects))
+					self.music_looper = timers.call_later(length, lambda: self.play_music(name, -1, length, effects))
 			else:
 				if length != 0:
 					length = 1
@@ -378,103 +471,50 @@ class AreaManager:
 			"""
 			Shuffles through tracks randomly, either from entire music list or specific category.
 			"""
-			arg = arg
-			client = client
 			if len(arg) != 0:
-				index = 0
-				for item in self.server.music_list:
-					if item['category'] == arg:
-						for song in item['songs']:
-							index += 1
-				if index == 0:
-					client.send_ooc('Category/music not found.')
-					return
-				else:
-					music_set = set(range(index))
-					trackid = random.choice(tuple(music_set))
-					while trackid == track:
-						trackid = random.choice(tuple(music_set))
-					index = 0
-					for item in self.server.music_list:
-						if item['category'] == arg:
-							for song in item['songs']:
-								if index == trackid:
-									self.play_music_shownamed(song['name'], client.char_id, '{} Shuffle'.format(arg))
-									self.music_looper = asyncio.get_event_loop().call_later(song['length'], lambda: self.music_shuffle(arg, client, trackid))
-									self.add_music_playing(client, song['name'])
-									database.log_room('play', client, self, message=song['name'])
-									return
-								else:
-									index += 1
+				songs = self.server.music_catalog.get_loopable(arg)
+				showname = '{} Shuffle'.format(arg)
 			else:
-				index = 0
-				for item in self.server.music_list:
-					for song in item['songs']:
-						index += 1
-				if index == 0:
-					client.send_ooc('Category/music not found.')
-					return
-				else:
-					music_set = set(range(index))
-					trackid = random.choice(tuple(music_set))
-					while trackid == track:
-						trackid = random.choice(tuple(music_set))
-					index = 0
-					for item in self.server.music_list:
-						for song in item['songs']:
-							if index == trackid:
-								self.play_music_shownamed(song['name'], client.char_id, 'Random Shuffle')
-								self.music_looper = asyncio.get_event_loop().call_later(song['length'], lambda: self.music_shuffle(arg, client, trackid))
-								self.add_music_playing(client, song['name'])
-								database.log_room('play', client, self, message=song['name'])
-								return
-							else:
-								index += 1
+				songs = self.server.music_catalog.get_loopable()
+				showname = 'Random Shuffle'
+			if len(songs) == 0:
+				client.send_ooc('Category/music not found.')
+				return
+			trackid = self.pick_track(songs, track)
+			song = songs[trackid]
+			self.play_music_shownamed(song.name, client.char_id, showname)
+			self.music_looper = timers.call_later(song.length, lambda: self.music_shuffle(arg, client, trackid))
+			self.add_music_playing(client, song.name)
+			database.log_room('play', client, self, message=song.name)
 
 		def musiclist_shuffle(self, client, track=-1):
-			client = client
-			index = 0
-			for item in client.area.cmusic_list:
-				if 'songs' in item:
-					for song in item['songs']:
-						index += 1
-				else:
-					index += 1
-			if index == 0:
+			if len(self.cmusic_catalog) == 0:
 				client.send_ooc('Area musiclist empty.')
 				return
-			else:
-				music_set = set(range(index))
-				trackid = random.choice(tuple(music_set))
-				while trackid == track:
-					trackid = random.choice(tuple(music_set))
-				index = 0
-				for item in client.area.cmusic_list:
-					if 'songs' in item:
-						for song in item['songs']:
-							if index == trackid:
-								if song['length'] <= 5:
-									client.send_ooc('Track seems to have too little or no length, shuffle canceled.')
-									return
-								self.play_music_shownamed(song['name'], client.char_id, 'Custom Shuffle')
-								self.music_looper = asyncio.get_event_loop().call_later(song['length'], lambda: self.musiclist_shuffle(client, trackid))
-								self.add_music_playing(client, song['name'])
-								database.log_room('play', client, self, message=song['name'])
-								return
-							else:
-								index += 1
-					else:
-						if index == trackid:
-							if item['length'] <= 5:
-								client.send_ooc('Track seems to have too little or no length, shuffle canceled.')
-								return
-							self.play_music_shownamed(item['name'], client.char_id, 'Custom Shuffle')
-							self.music_looper = asyncio.get_event_loop().call_later(item['length'], lambda: self.musiclist_shuffle(client, trackid))
-							self.add_music_playing(client, item['name'])
-							database.log_room('play', client, self, message=item['name'])
-							return
-						else:
-							index += 1
+			songs = self.cmusic_catalog.get_loopable()
+			if len(songs) == 0:
+				client.send_ooc('Track seems to have too little or no length, shuffle canceled.')
+				return
+			trackid = self.pick_track(songs, track)
+			song = songs[trackid]
+			self.play_music_shownamed(song.name, client.char_id, 'Custom Shuffle')
+			self.music_looper = timers.call_later(song.length, lambda: self.musiclist_shuffle(client, trackid))
+			self.add_music_playing(client, song.name)
+			database.log_room('play', client, self, message=song.name)
+
+		def pick_track(self, songs, track=-1):
+			"""
+			Pick a random track index, other than the one played last
+			if there is a choice.
+			:param songs: list of tracks to pick from
+			:param track: index of the track played last (Default value = -1)
+			"""
+			if not 0 <= track < len(songs) or len(songs) == 1:
+				return random.randrange(len(songs))
+			trackid = random.randrange(len(songs) - 1)
+			if trackid >= track:
+				trackid += 1
+			return trackid
 
 		def can_send_message(self, client):
 			"""
@@ -655,7 +695,8 @@ class AreaManager:
 			Get the evidence list of the area.
 			:param client: requester
 			"""
-			client.evi_list, evi_list = self.evi_list.create_evi_list(client)
+			nums_list, evi_list = self.evi_list.create_evi_list(client)
+			client.set_evi_list(nums_list)
 			return evi_list
 
 		def broadcast_evidence_list(self):
@@ -707,7 +748,8 @@ class AreaManager:
 							song_list.append(song['name'])
 			return song_list
 
-		def conn_arup_players(self):
+		def get_conn_arup_players(self):
+			"""Build the ARUP list of player counts."""
 			players_list = [0]
 			lobby = self.server.area_manager.default_area()
 			players_list.append(len(lobby.clients))
@@ -725,10 +767,10 @@ class AreaManager:
 						players_list.append(-1)
 					else:
 						players_list.append(len(link.clients))
-			self.server.send_conn_arup(players_list, self)	
+			return players_list
 
-		def conn_arup_status(self):
-			"""Broadcast ARUP packet containing area statuses."""
+		def get_conn_arup_status(self):
+			"""Build the ARUP list of area statuses."""
 			status_list = [1]
 			lobby = self.server.area_manager.default_area()
 			status_list.append(lobby.status)
@@ -737,10 +779,10 @@ class AreaManager:
 			for link in self.connections:
 				if link != lobby and link != self.hub:
 					status_list.append(link.status)
-			self.server.send_conn_arup(status_list, self)
+			return status_list
 			
-		def conn_arup_cms(self):
-			"""Broadcast ARUP packet containing area CMs."""
+		def get_conn_arup_cms(self):
+			"""Build the ARUP list of area CMs."""
 			cms_list = [2]
 			lobby = self.server.area_manager.default_area()
 			if len(lobby.owners) == 0:
@@ -761,10 +803,10 @@ class AreaManager:
 					if len(link.owners) > 0:
 						cm = link.get_cms()
 					cms_list.append(cm)
-			self.server.send_conn_arup(cms_list, self)
+			return cms_list
 			
-		def conn_arup_lock(self):
-			"""Broadcast ARUP packet containing the lock status of each area."""
+		def get_conn_arup_lock(self):
+			"""Build the ARUP list of the lock status of each area."""
 			lock_list = [3]
 			lobby = self.server.area_manager.default_area()
 			lock_list.append(lobby.is_locked.name)
@@ -773,10 +815,10 @@ class AreaManager:
 			for link in self.connections:
 				if link != lobby and link != self.hub:
 					lock_list.append(link.is_locked.name)
-			self.server.send_hub_arup(lock_list, self)
+			return lock_list
 
-		def sub_arup_players(self, client=None):
-			"""Broadcast ARUP packet containing player counts."""
+		def get_sub_arup_players(self):
+			"""Build the ARUP list of player counts."""
 			players_list = [0]
 			lobby = self.server.area_manager.default_area()
 			players_list.append(len(lobby.clients))
@@ -785,31 +827,21 @@ class AreaManager:
 				if area.hidden == True:
 					players_list.append(-1)
 				else:
-					index = 0
-					for c in area.clients:
-						if not c.ghost and not c.hidden:
-							index += 1
-					players_list.append(index)
-			if client != None:
-				client.send_self_arup(players_list)
-			else:
-				self.server.send_hub_arup(players_list, self)
+					players_list.append(len(area.visible_clients))
+			return players_list
 
-		def sub_arup_status(self, client=None):
-			"""Broadcast ARUP packet containing area statuses."""
+		def get_sub_arup_status(self):
+			"""Build the ARUP list of area statuses."""
 			status_list = [1]
 			lobby = self.server.area_manager.default_area()
 			status_list.append(lobby.status)
 			status_list.append(self.status)
 			for area in self.subareas:
 				status_list.append(area.status)
-			if client != None:
-				client.send_self_arup(status_list)
-			else:
-				self.server.send_hub_arup(status_list, self)
+			return status_list
 
-		def sub_arup_cms(self, client=None):
-			"""Broadcast ARUP packet containing area CMs."""
+		def get_sub_arup_cms(self):
+			"""Build the ARUP list of area CMs."""
 			cms_list = [2]
 			lobby = self.server.area_manager.default_area()
 			if len(lobby.owners) == 0:
@@ -825,23 +857,135 @@ class AreaManager:
 				if len(area.owners) > 0:
 					cm = area.get_cms()
 				cms_list.append(cm)
-			if client != None:
-				client.send_self_arup(cms_list)
-			else:
-				self.server.send_hub_arup(cms_list, self)
+			return cms_list
 
-		def sub_arup_lock(self, client=None):
-			"""Broadcast ARUP packet containing the lock status of each area."""
+		def get_sub_arup_lock(self):
+			"""Build the ARUP list of the lock status of each area."""
 			lock_list = [3]
 			lobby = self.server.area_manager.default_area()
 			lock_list.append(lobby.is_locked.name)
 			lock_list.append(self.is_locked.name)
 			for area in self.subareas:
 				lock_list.append(area.is_locked.name)
+			return lock_list
+
+		def conn_arup_players(self):
+			"""Broadcast ARUP packet containing player counts."""
+			self.server.area_manager.schedule(self.flush_conn_arup, 0)
+
+		def conn_arup_status(self):
+			"""Broadcast ARUP packet containing area statuses."""
+			self.server.area_manager.schedule(self.flush_conn_arup, 1)
+
+		def conn_arup_cms(self):
+			"""Broadcast ARUP packet containing area CMs."""
+			self.server.area_manager.schedule(self.flush_conn_arup, 2)
+
+		def conn_arup_lock(self):
+			"""Broadcast ARUP packet containing the lock status of each area."""
+			self.server.area_manager.schedule(self.flush_conn_arup, 3)
+
+		def flush_conn_arup(self, kind):
+			"""
+			Broadcast an ARUP list to the clients of this restricted subarea.
+			:param kind: ARUP type (0: players, 1: status, 2: CMs, 3: lock)
+			"""
+			if kind == 0:
+				self.server.send_conn_arup(self.get_conn_arup_players(), self)
+			elif kind == 1:
+				self.server.send_conn_arup(self.get_conn_arup_status(), self)
+			elif kind == 2:
+				self.server.send_conn_arup(self.get_conn_arup_cms(), self)
+			else:
+				self.server.send_hub_arup(self.get_conn_arup_lock(), self)
+
+		def sub_arup_players(self, client=None):
+			"""Broadcast ARUP packet containing player counts."""
+			self.sub_arup_kind(0, client)
+
+		def sub_arup_status(self, client=None):
+			"""Broadcast ARUP packet containing area statuses."""
+			self.sub_arup_kind(1, client)
+
+		def sub_arup_cms(self, client=None):
+			"""Broadcast ARUP packet containing area CMs."""
+			self.sub_arup_kind(2, client)
+
+		def sub_arup_lock(self, client=None):
+			"""Broadcast ARUP packet containing the lock status of each area."""
+			self.sub_arup_kind(3, client)
+
+		def sub_arup_kind(self, kind, client=None):
+			"""
+			Send an ARUP list of this hub to a single client right away,
+			or broadcast it to the hub once the current event loop
+			iteration is done.
+			:param kind: ARUP type (0: players, 1: status, 2: CMs, 3: lock)
+			:param client: client to send to (Default value = None)
+			"""
 			if client != None:
-				client.send_self_arup(lock_list)
+				client.send_self_arup(self.get_sub_arup(kind))
 			else:
-				self.server.send_hub_arup(lock_list, self)
+				self.server.area_manager.schedule(self.flush_sub_arup, kind)
+
+		def get_sub_arup(self, kind):
+			"""
+			Build an ARUP list of this hub.
+			:param kind: ARUP type (0: players, 1: status, 2: CMs, 3: lock)
+			"""
+			if kind == 0:
+				return self.get_sub_arup_players()
+			elif kind == 1:
+				return self.get_sub_arup_status()
+			elif kind == 2:
+				return self.get_sub_arup_cms()
+			return self.get_sub_arup_lock()
+
+		def flush_sub_arup(self, kind):
+			"""
+			Broadcast an ARUP list to the clients of this hub.
+			:param kind: ARUP type (0: players, 1: status, 2: CMs, 3: lock)
+			"""
+			self.server.send_hub_arup(self.get_sub_arup(kind), self)
+
+		def send_chars_check(self):
+			"""
+			Broadcast the characters taken in this area once the current
+			event loop iteration is done.
+			"""
+			self.server.area_manager.schedule(self.flush_chars_check)
+
+		def get_chars_check(self):
+			"""
+			Get the CharsCheck list of characters taken in this area.
+			The list is shared and must not be modified.
+			"""
+			char_count = len(self.server.char_list)
+			if self._chars_check is None or len(self._chars_check) != char_count:
+				chars_check = [0] * char_count
+				for char_id in self.char_occupancy:
+					if 0 <= char_id < char_count:
+						chars_check[char_id] = -1
+				self._chars_check = chars_check
+				self._chars_check_packet = Packet('CharsCheck', *chars_check)
+				self._free_char_ids = None
+			return self._chars_check
+
+		@property
+		def chars_check_packet(self):
+			"""The CharsCheck packet of characters taken in this area."""
+			self.get_chars_check()
+			return self._chars_check_packet
+
+		def flush_chars_check(self):
+			"""Broadcast the characters taken in this area."""
+			packet = self.chars_check_packet
+			for c in self.clients:
+				if len(c.charcurse) > 0:
+					c.send_command('CharsCheck', *c.get_available_char_list())
+				else:
+					c.send_packet(packet)
+
 
 		def broadcast_hub(self, client, msg):
 			char_name = client.char_name
@@ -870,9 +1014,21 @@ class AreaManager:
 		self.server = server
 		self.cur_id = 0
 		self.areas = []
+		# Lookup indexes, rebuilt by index_areas()
+		self.areas_by_name = {}
+		self.areas_by_abbreviation = {}
+		self.areas_by_id = {}
+		self.subareas_by_name = {}
 		self.load_areas()
 		self.timer = AreaManager.Timer()
 
+		# Broadcasts scheduled during the current event loop iteration,
+		# each run once at the end of it.
+		self.pending = {}
+		self.pending_handle = None
+		# Last global ARUP lists broadcast, by ARUP type.
+		self.arup_sent = {}
+
 	def load_areas(self):
 		"""Create all areas from a YAML file."""
 		with open('config/areas.yaml', 'r') as chars:
@@ -902,41 +1058,66 @@ class AreaManager:
 				item['hubtype'] = 'default'
 			self.areas.append(self.Area(self.cur_id, self.server, item['area'], item['background'], item['bglock'], item['evidence_mod'], item['locking_allowed'], item['iniswap_allowed'],item['showname_changes_allowed'], item['shouts_allowed'], item['jukebox'], item['abbreviation'], item['noninterrupting_pres'], item['is_hub'], item['hub_id'], item['hubtype']))
 			self.cur_id += 1
+		self.index_areas()
+
+	def index_areas(self):
+		"""
+		Rebuild the area lookup indexes. Must be called whenever an
+		area or hub subarea is added, removed or renamed.
+		Where several areas share a key, the first one in area order
+		(subareas following their hub) is indexed.
+		"""
+		by_name = {}
+		by_abbreviation = {}
+		by_id = {}
+		subareas_by_name = {}
+		for area in self.areas:
+			by_name.setdefault(area.name, area)
+			by_abbreviation.setdefault(area.abbreviation, area)
+			by_id.setdefault(area.id, area)
+			if area.is_hub:
+				subs = subareas_by_name[area] = {}
+				for sub in area.subareas:
+					subs.setdefault(sub.name, sub)
+					by_abbreviation.setdefault(sub.abbreviation, sub)
+		self.areas_by_name = by_name
+		self.areas_by_abbreviation = by_abbreviation
+		self.areas_by_id = by_id
+		self.subareas_by_name = subareas_by_name
 
 	def default_area(self):
 		"""Get the default area."""
 		return self.areas[0]
 
 	def get_area_by_name(self, name, client=None):
-		"""Get an area by name."""
-		for area in self.areas:
-			if area.name == name:
-				return area
-			if area.is_hub:
-				if client != None:
-					if client.area == area or client.area.hub == area:
-						for sub in area.subareas:
-							if sub.name == name:
-								return sub
-		raise AreaError('Area not found.')
+		"""
+		Get an area by name. Subareas are only found if the client is
+		in their hub.
+		"""
+		area = self.areas_by_name.get(name)
+		if client != None:
+			hub = client.area if client.area.is_hub else client.area.hub
+			if hub != None and (area == None or hub.id < area.id):
+				sub = self.subareas_by_name.get(hub, {}).get(name)
+				if sub != None:
+					return sub
+		if area == None:
+			raise AreaError('Area not found.')
+		return area
 	
 	def get_area_by_abbreviation(self, abbreviation):
-		"""Get an area by name."""
-		for area in self.areas:
-			if area.abbreviation == abbreviation:
-				return area
-			if area.is_hub:
-				for sub in area.subareas:
-					if sub.abbreviation == abbreviation:
-						return sub
-		raise AreaError('Area not found.')
+		"""Get an area by abbreviation."""
+		try:
+			return self.areas_by_abbreviation[abbreviation]
+		except KeyError:
+			raise AreaError('Area not found.')
 
 	def get_area_by_id(self, num):
 		"""Get an area by ID."""
-		for area in self.areas:
-			if area.id == num:
-				return area
-		raise AreaError('Area not found.')
+		try:
+			return self.areas_by_id[num]
+		except (KeyError, TypeError):
+			raise AreaError('Area not found.')
 
 	def abbreviate(self, name):
 		"""Abbreviate the name of a room."""
@@ -959,62 +1140,127 @@ class AreaManager:
 		:param cmd: command name
 		:param *args: command arguments
 		"""
+		packet = Packet(cmd, *args)
 		for area in areas:
-			area.send_command(cmd, *args)
-			area.send_owner_command(cmd, *args)
+			area.send_packet(packet)
+			area.send_owner_packet(packet)
 
-	def send_arup_players(self):
-		"""Broadcast ARUP packet containing player counts."""
+	def get_arup_players(self):
+		"""Build the ARUP list of player counts."""
 		players_list = [0]
 		for area in self.areas:
 			if area.hidden == True:
 				players_list.append(-1)
 			else:
-				index = 0
-				for client in area.clients:
-					if not client.ghost and not client.hidden:
-						index += 1
+				count = len(area.visible_clients)
 				if area.is_hub:
 					for sub in area.subareas:
-						for client in sub.clients:
-							if not client.ghost and not client.hidden:
-								index += 1
-				players_list.append(index)
-		self.server.send_arup(players_list)
+						count += len(sub.visible_clients)
+				players_list.append(count)
+		return players_list
 
-	def send_arup_status(self, client=None):
-		"""Broadcast ARUP packet containing area statuses."""
-		status_list = [1]
-		for area in self.areas:
-			status_list.append(area.status)
-		if client != None:
-			client.send_self_arup(status_list)
-		else:
-			self.server.send_arup(status_list)
+	def get_arup_status(self):
+		"""Build the ARUP list of area statuses."""
+		return [1] + [area.status for area in self.areas]
 
-	def send_arup_cms(self, client=None):
-		"""Broadcast ARUP packet containing area CMs."""
+	def get_arup_cms(self):
+		"""Build the ARUP list of area CMs."""
 		cms_list = [2]
 		for area in self.areas:
 			cm = 'FREE'
 			if len(area.owners) > 0:
 				cm = area.get_cms()
 			cms_list.append(cm)
-		if client != None:
-			client.send_self_arup(cms_list)
-		else:
-			self.server.send_arup(cms_list)
+		return cms_list
+
+	def get_arup_lock(self):
+		"""Build the ARUP list of the lock status of each area."""
+		return [3] + [area.is_locked.name for area in self.areas]
+
+	def send_arup_players(self, client=None):
+		"""Broadcast ARUP packet containing player counts."""
+		self.send_arup_kind(0, client)
+
+	def send_arup_status(self, client=None):
+		"""Broadcast ARUP packet containing area statuses."""
+		self.send_arup_kind(1, client)
+
+	def send_arup_cms(self, client=None):
+		"""Broadcast ARUP packet containing area CMs."""
+		self.send_arup_kind(2, client)
 
 	def send_arup_lock(self, client=None):
 		"""Broadcast ARUP packet containing the lock status of each area."""
-		lock_list = [3]
-		for area in self.areas:
-			lock_list.append(area.is_locked.name)
+		self.send_arup_kind(3, client)
+
+	def get_arup(self, kind):
+		"""
+		Build a global ARUP list.
+		:param kind: ARUP type (0: players, 1: status, 2: CMs, 3: lock)
+		"""
+		if kind == 0:
+			return self.get_arup_players()
+		elif kind == 1:
+			return self.get_arup_status()
+		elif kind == 2:
+			return self.get_arup_cms()
+		return self.get_arup_lock()
+
+	def send_arup_kind(self, kind, client=None):
+		"""
+		Send an ARUP list to a single client right away, or broadcast it
+		once the current event loop iteration is done.
+		:param kind: ARUP type (0: players, 1: status, 2: CMs, 3: lock)
+		:param client: client to send to (Default value = None)
+		"""
 		if client != None:
-			client.send_self_arup(lock_list)
+			client.send_self_arup(self.get_arup(kind))
 		else:
-			self.server.send_arup(lock_list)
-		
+			self.schedule(self.flush_arup, kind)
+
+	def refresh_arup(self):
+		"""
+		Rebroadcast every ARUP list, even if unchanged. Needed after
+		clients are sent a new area list.
+		"""
+		self.arup_sent.clear()
+		for kind in range(4):
+			self.send_arup_kind(kind)
+
+	def flush_arup(self, kind):
+		"""
+		Broadcast a global ARUP list if it changed since it was last sent.
+		:param kind: ARUP type (0: players, 1: status, 2: CMs, 3: lock)
+		"""
+		arup_list = self.get_arup(kind)
+		if self.arup_sent.get(kind) == arup_list:
+			return
+		self.arup_sent[kind] = arup_list
+		self.server.send_arup(arup_list)
+
+	def schedule(self, callback, *args):
+		"""
+		Run a broadcast at the end of the current event loop iteration.
+		Scheduling the same broadcast again before then is a no-op, so
+		mass moves cost one broadcast per area instead of one per client.
+		:param callback: function sending the broadcast
+		:param *args: arguments to the callback
+		"""
+		key = (callback, args)
+		if key in self.pending:
+			return
+		self.pending[key] = None
+		if self.pending_handle is None:
+			self.pending_handle = asyncio.get_event_loop().call_soon(
+				self.flush_pending)
+
+	def flush_pending(self):
+		"""Run every broadcast scheduled since the last flush."""
+		self.pending_handle = None
+		pending, self.pending = self.pending, {}
+		for callback, args in pending:
+			callback(*args)
+
 	def mods_online(self):
 		num = 0
 		for area in self.areas:
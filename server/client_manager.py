@@ -19,15 +19,16 @@
 
 import yaml
 import os
-import re
 import time
 import random
+import unicodedata
 from heapq import heappop, heappush
 
 from server import database
 from server.timer import Timer
 from server.constants import TargetType
 from server.exceptions import ClientError, AreaError
+from server.network.packet import Packet
 
 
 class ClientManager:
@@ -40,18 +41,22 @@ class ClientManager:
 		def __init__(self, server, transport, user_id, ipid):
 			self.is_checked = False
 			self.transport = transport
-			self.hdid = ''
+			# Indexed by the client manager once the client is added
+			self._hdid = ''
 			self.id = user_id
-			self.char_id = -1
+			self._char_id = -1
 			self.area = server.area_manager.default_area()
 			self.server = server
-			self.name = ''
+			self._name = ''
+			# ((name, hostname), error) of the last name checked
+			self._name_error = (None, None)
 			self.showname = ''
 			self.fake_name = ''
 			self.is_dj = True
 			self.can_wtce = True
 			self.pos = ''
 			self.evi_list = []
+			self.evi_lookup = {}
 			self.disemvowel = False
 			self.shaken = False
 			self.gimp = False
@@ -75,11 +80,11 @@ class ClientManager:
 			self.is_mod = False
 			self.mod_profile_name = None
 			self.permission = False
-			self.ghost = False
+			self._ghost = False
 			self.spying = []
 			
 			# Misc. IC stuff
-			self.hidden = False
+			self._hidden = False
 			self.visible = True
 			self.narrator = False
 			self.areapair = 'middle'
@@ -119,9 +124,6 @@ class ClientManager:
 			self.casing_jur = False
 			self.casing_steno = False
 			self.case_call_time = 0
-			
-			# Security/Multiclient stuff
-			self.clientscon = 0
 
 			# flood-guard stuff
 			self.mus_counter = 0
@@ -164,18 +166,31 @@ class ClientManager:
 			:param command: command name
 			:param *args: list of arguments
 			"""
-			if args:
-				if command == 'MS':
-					for evi_num in range(len(self.evi_list)):
-						if self.evi_list[evi_num] == args[11]:
-							lst = list(args)
-							lst[11] = evi_num
-							args = tuple(lst)
-							break
-				self.send_raw_message(
-					f'{command}#{"#".join([str(x) for x in args])}#%')
-			else:
-				self.send_raw_message(f'{command}#%')
+			self.send_packet(Packet(command, *args))
+
+		def send_packet(self, packet):
+			"""
+			Send a pre-composed packet. The encoded bytes are shared with
+			every other recipient of the packet, unless this client needs
+			its own copy.
+			:param packet: packet to send
+			"""
+			if packet.command == 'MS':
+				evidence = packet.args[11]
+				local = self.evi_lookup.get(evidence, evidence)
+				if local != evidence:
+					self.transport.write(packet.variant(11, local))
+					return
+			self.transport.write(packet.data)
+
+		def set_evi_list(self, evi_list):
+			"""
+			Set the list of evidence IDs visible to the client.
+			:param evi_list: area evidence IDs, indexed by the IDs
+			the client uses
+			"""
+			self.evi_list = evi_list
+			self.evi_lookup = {evi: num for num, evi in enumerate(evi_list)}
 
 		def send_ooc(self, msg):
 			"""
@@ -231,10 +246,38 @@ class ClientManager:
 			name_ws = name.replace(' ', '')
 			if not name_ws or name_ws.isdigit():
 				return False
-			for client in self.server.client_manager.clients:
-				if client.name == name and self.ipid != client.ipid:
-					return False
-			return True
+			owners = self.server.client_manager.name_owners.get(name)
+			return not owners or owners.keys() == {self.ipid}
+
+		@property
+		def name_error(self):
+			"""
+			Get why the client cannot talk in OOC with its current name, or
+			None if it can. Checked once per name.
+			"""
+			key = (self._name, self.server.config['hostname'])
+			if self._name_error[0] != key:
+				self._name_error = (key, self.check_name(*key))
+			return self._name_error[1]
+
+		@staticmethod
+		def check_name(name, hostname):
+			"""
+			Check an OOC name against the naming rules.
+			:param name: OOC name
+			:param hostname: name the server talks under in OOC
+			:returns: error message, or None if the name is allowed
+			"""
+			if name == '':
+				return 'You must insert a name with at least one letter'
+			if len(name) > 30:
+				return 'Your OOC name is too long! Limit it to 30 characters.'
+			for c in name:
+				if unicodedata.category(c) == 'Cf':
+					return 'You cannot use format characters in your name!'
+			if name.startswith(hostname) or name.startswith('<dollar>G') or name.startswith('<dollar>M'):
+				return 'That name is reserved!'
+			return None
 
 		def disconnect(self):
 			"""Disconnect the client gracefully."""
@@ -267,7 +310,7 @@ class ClientManager:
 			self.pos = ''
 			self.send_command('PV', self.id, 'CID', self.char_id, switch)
 			self.send_command('SP', self.pos) #Send a "Set Position" packet
-			self.area.send_command('CharsCheck', *self.get_available_char_list())
+			self.area.send_chars_check()
 			new_char = self.char_name
 			database.log_room('char.change', self, self.area,
 				message={'from': old_char, 'to': new_char})
@@ -463,6 +506,7 @@ class ClientManager:
 					for a in self.server.area_manager.areas:
 						area_list.append(a.name)
 					self.send_command('FA', *area_list)
+					self.server.area_manager.send_arup_players(self)
 					self.server.area_manager.send_arup_cms(self)
 					self.server.area_manager.send_arup_status(self)
 					self.server.area_manager.send_arup_lock(self)
@@ -559,7 +603,7 @@ class ClientManager:
 						self.area.broadcast_ooc(f'{self.char_name} has entered from {old_area.name}.')
 			for c in self.followers:
 				c.change_area(area)
-			self.area.send_command('CharsCheck', *self.get_available_char_list())
+			self.area.send_chars_check()
 			self.send_command('HP', 1, self.area.hp_def)
 			self.send_command('HP', 2, self.area.hp_pro)
 			self.send_command('BN', self.area.background, self.pos)
@@ -775,17 +819,7 @@ class ClientManager:
 				except AreaError:
 					raise
 			if not all and multiclients:
-				checked = []
-				cnt = 0
-				for client in self.server.client_manager.clients:
-					if client in checked:
-						continue
-					for client2 in self.server.client_manager.clients:
-						if client != client2 and client.ipid == client2.ipid:
-							cnt += 1
-							checked.append(client2)
-					checked.append(client)
-					checked.append(client2)
+				cnt = self.server.client_manager.multiclient_count
 				info = f'Current multiclients: {cnt}'
 			self.send_ooc(info)
 
@@ -795,17 +829,21 @@ class ClientManager:
 			This unconditionally causes the client to show the character
 			selection screen, even if the client has already joined.
 			"""
-			self.send_command('CharsCheck', *self.get_available_char_list())
+			if len(self.charcurse) > 0:
+				self.send_command('CharsCheck', *self.get_available_char_list())
+			else:
+				self.send_packet(self.area.chars_check_packet)
 			self.send_command('HP', 1, self.area.hp_def)
 			self.send_command('HP', 2, self.area.hp_pro)
 			self.send_command('BN', self.area.background)
 			self.send_command('LE', *self.area.get_evidence_list(self))
 			self.send_command('MM', 1)
 
-			self.server.area_manager.send_arup_players()
-			self.server.area_manager.send_arup_status()
-			self.server.area_manager.send_arup_cms()
-			self.server.area_manager.send_arup_lock()
+			if not self.area.is_hub and not self.area.sub:
+				self.server.area_manager.send_arup_players(self)
+				self.server.area_manager.send_arup_status(self)
+				self.server.area_manager.send_arup_cms(self)
+				self.server.area_manager.send_arup_lock(self)
 
 			self.send_command('DONE')
 
@@ -816,17 +854,12 @@ class ClientManager:
 
 		def get_available_char_list(self):
 			"""Get a list of character IDs that the client can select."""
-			if len(self.charcurse) > 0:
-				avail_char_ids = set(range(len(
-					self.server.char_list))) and set(self.charcurse)
-			else:
-				avail_char_ids = set(range(len(self.server.char_list))) - {
-					x.char_id
-					for x in self.area.clients
-				}
+			if len(self.charcurse) == 0:
+				return list(self.area.get_chars_check())
 			char_list = [-1] * len(self.server.char_list)
-			for x in avail_char_ids:
-				char_list[x] = 0
+			for x in self.charcurse:
+				if 0 <= x < len(char_list):
+					char_list[x] = 0
 			return char_list
 
 		def auth_mod(self, password):
@@ -881,15 +914,85 @@ class ClientManager:
 					self.send_command("FAILEDLOGIN");
 					raise ClientError('Invalid password.')
 
+		@property
+		def ghost(self):
+			"""Whether the client is invisible to other players."""
+			return self._ghost
+
+		@ghost.setter
+		def ghost(self, value):
+			self._ghost = value
+			self.area.update_visible(self)
+
+		@property
+		def hidden(self):
+			"""Whether the client is hidden by a CM."""
+			return self._hidden
+
+		@hidden.setter
+		def hidden(self, value):
+			self._hidden = value
+			self.area.update_visible(self)
+
+		@property
+		def name(self):
+			"""Get the OOC name of the client."""
+			return self._name
+
+		@name.setter
+		def name(self, name):
+			old_name, self._name = self._name, name
+			manager = self.server.client_manager
+			manager.names.move(self, old_name, name)
+			manager.release_name(self, old_name)
+			if name:
+				owners = manager.name_owners.setdefault(name, {})
+				owners.setdefault(self.ipid, set()).add(self)
+
+		@property
+		def hdid(self):
+			"""Get the hardware ID the client sent in its handshake."""
+			return self._hdid
+
+		@hdid.setter
+		def hdid(self, hdid):
+			manager = self.server.client_manager
+			manager.discard_hdid(self)
+			self._hdid = hdid
+			manager.clients_by_hdid.setdefault(hdid, set()).add(self)
+
+		@property
+		def char_id(self):
+			"""Get the ID of the character the client is using."""
+			return self._char_id
+
+		@char_id.setter
+		def char_id(self, char_id):
+			old_char_id, old_name = self._char_id, self.char_name
+			self._char_id = char_id
+			self.server.client_manager.char_names.move(self, old_name,
+				self.char_name)
+			if self in self.area.clients:
+				self.area.move_char(old_char_id, char_id)
+
 		@property
 		def ip(self):
 			"""Get an anonymized version of the IP address."""
 			return self.ipid
 
+		@property
+		def clientscon(self):
+			"""Get the number of clients connected from this IPID."""
+			return len(self.server.client_manager.get_multiclients(self.ipid))
+
 		@property
 		def char_name(self):
-			"""Get the name of the character that the client is using."""
-			if self.char_id == -1:
+			"""
+			Get the name of the character that the client is using, or
+			None if it is spectating or its character was removed from
+			the character list.
+			"""
+			if not 0 <= self.char_id < len(self.server.char_list):
 				return None
 			return self.server.char_list[self.char_id]
 
@@ -920,70 +1023,216 @@ class ClientManager:
 
 		def disemvowel_message(self, message):
 			"""Disemvowel a chat message."""
-			message = re.sub('[aeiou]', '', message, flags=re.IGNORECASE)
-			return re.sub(r'\s+', ' ', message)
+			return self.server.text_pipeline.disemvowel(message)
 
 		def shake_message(self, message):
 			"""Mix the words in a chat message."""
-			import random
-			parts = message.split()
-			random.shuffle(parts)
-			return ' '.join(parts)
+			return self.server.text_pipeline.shake(message)
 
 		def gimp_message(self, message):
 			message = self.server.gimp_list
 			return random.choice(message)
 
+	class NameIndex:
+		"""
+		Trie of the names of connected clients, case-insensitive, used to
+		find the clients whose name starts a piece of text.
+		"""
+		# Key of the clients whose name ends at a node
+		CLIENTS = None
+
+		def __init__(self):
+			self.root = {}
+
+		def add(self, client, name):
+			"""Index a client by name. Empty names are not indexed."""
+			if not name:
+				return
+			node = self.root
+			for char in name.lower():
+				node = node.setdefault(char, {})
+			node.setdefault(self.CLIENTS, set()).add(client)
+
+		def remove(self, client, name):
+			"""Remove a client indexed under a name, pruning empty nodes."""
+			if not name:
+				return
+			name = name.lower()
+			path = [self.root]
+			for char in name:
+				node = path[-1].get(char)
+				if node is None:
+					return
+				path.append(node)
+			clients = path[-1].get(self.CLIENTS)
+			if clients is None:
+				return
+			clients.discard(client)
+			if not clients:
+				del path[-1][self.CLIENTS]
+			for depth in range(len(name), 0, -1):
+				if path[depth]:
+					break
+				del path[depth - 1][name[depth - 1]]
+
+		def move(self, client, old_name, new_name):
+			"""Reindex a client after a name change."""
+			if old_name != new_name:
+				self.remove(client, old_name)
+				self.add(client, new_name)
+
+		def match(self, text):
+			"""
+			Find the clients whose name is a prefix of a piece of text.
+			:returns: list of clients, longest names first
+			"""
+			matches = []
+			node = self.root
+			for char in text.lower():
+				node = node.get(char)
+				if node is None:
+					break
+				clients = node.get(self.CLIENTS)
+				if clients:
+					matches.append(clients)
+			return [client for clients in reversed(matches)
+				for client in clients]
+
 	def __init__(self, server):
 		self.clients = set()
+		# Live indexes of connected clients, kept up to date by the
+		# Client name, hdid and char_id setters
+		self.clients_by_id = {}
+		self.clients_by_ipid = {}
+		self.clients_by_hdid = {}
+		self.names = self.NameIndex()
+		self.char_names = self.NameIndex()
+		# OOC name -> {IPID: its clients using the name}
+		self.name_owners = {}
 		self.server = server
-		self.available_ids = [i for i in range(self.server.config['playerlimit'])]
-		self.all_ids = [i for i in range(self.server.config['playerlimit'])]
+		# Min-heap of free player IDs, so the lowest is always handed out
+		self.available_ids = list(range(self.server.config['playerlimit']))
+		self.used_ids = set()
 
 	def new_client_preauth(self, client):
+		"""
+		Check whether a new client is within the multiclient limit.
+		:param client: client, already counted among its IPID's clients
+		"""
 		maxclients = self.server.config['multiclient_limit']
-		for c in self.server.client_manager.clients:
-			if c.ipid == client.ipid:
-				if c.clientscon > maxclients:
-					return False
-		return True
+		return len(self.get_multiclients(client.ipid)) <= maxclients
+
+	def get_multiclients(self, ipid):
+		"""
+		Get the clients connected from an IPID.
+		:param ipid: IPID
+		:returns: set of clients, not to be modified
+		"""
+		return self.clients_by_ipid.get(ipid, frozenset())
+
+	@property
+	def multiclient_count(self):
+		"""Get the number of clients beyond the first of each IPID."""
+		return len(self.clients) - len(self.clients_by_ipid)
+
+	def allocate_id(self):
+		"""
+		Take the lowest free player ID.
+		:returns: player ID, or None if the server is full
+		"""
+		if not self.available_ids:
+			return None
+		user_id = heappop(self.available_ids)
+		self.used_ids.add(user_id)
+		return user_id
+
+	def release_id(self, user_id):
+		"""
+		Give a player ID back, if it was taken.
+		:param user_id: player ID
+		"""
+		if user_id in self.used_ids:
+			self.used_ids.remove(user_id)
+			heappush(self.available_ids, user_id)
 
 	def new_client(self, transport):
 		"""
 		Create a new client, add it to the list, and assign it a player ID.
 		:param transport: asyncio transport
 		"""
-		user_id = None
-		if len(self.available_ids) < 1:
+		user_id = self.allocate_id()
+		if user_id is None:
 			transport.write(b'BD#This server is full.#%')
 			raise ClientError
-		for id in self.all_ids:
-			if id in self.available_ids:
-				user_id = id
-				self.available_ids.remove(id)
-				break
-		if user_id == None:
-			transport.write(b'BD#Could not assign ID.#%')
-			raise ClientError
 		peername = transport.get_extra_info('peername')[0]
 		c = self.Client(
 			self.server, transport, user_id,
 			database.ipid(peername))
 		self.clients.add(c)
-		temp_ipid = c.ipid
-		for client in self.clients:
-			if client.ipid == temp_ipid:
-				client.clientscon += 1
+		self.clients_by_id[c.id] = c
+		self.clients_by_ipid.setdefault(c.ipid, set()).add(c)
+		self.clients_by_hdid.setdefault(c.hdid, set()).add(c)
 		return c
 
+	def release_name(self, client, name):
+		"""
+		Stop counting a client as a user of an OOC name. Does nothing if
+		it was not counted.
+		:param client: client
+		:param name: name the client was using
+		"""
+		owners = self.name_owners.get(name)
+		if owners is None or client.ipid not in owners:
+			return
+		owners[client.ipid].discard(client)
+		if not owners[client.ipid]:
+			del owners[client.ipid]
+			if not owners:
+				del self.name_owners[name]
+
+	def discard_hdid(self, client):
+		"""Remove a client from the HDID index."""
+		clients = self.clients_by_hdid.get(client.hdid)
+		if clients is not None:
+			clients.discard(client)
+			if not clients:
+				del self.clients_by_hdid[client.hdid]
+
+	def reindex_char_names(self):
+		"""
+		Rebuild the character name index, after the character list changed.
+		Clients on a character that no longer exists are sent back to the
+		character selection screen.
+		"""
+		self.char_names = self.NameIndex()
+		for client in self.clients:
+			self.char_names.add(client, client.char_name)
+		for client in list(self.clients):
+			if not self.server.is_valid_char_id(client.char_id) \
+					and client.char_id != -1:
+				client.char_select()
+
 	def remove_client(self, client):
 		"""
-		Remove a disconnected client from the client list.
+		Remove a disconnected client from the client list. Does nothing
+		if the client was already removed, such as by /kickother before
+		its connection is lost.
 		:param client: disconnected client
 		"""
-		if client.id not in self.available_ids:
-			self.available_ids.append(client.id)
+		if client not in self.clients:
+			return
+		self.release_id(client.id)
 		self.clients.remove(client)
+		if self.clients_by_id.get(client.id) is client:
+			del self.clients_by_id[client.id]
+		multiclients = self.clients_by_ipid[client.ipid]
+		multiclients.discard(client)
+		if not multiclients:
+			del self.clients_by_ipid[client.ipid]
+		self.discard_hdid(client)
+		self.names.remove(client, client.name)
+		self.release_name(client, client.name)
+		self.char_names.remove(client, client.char_name)
 		if client.area.jukebox:
 			client.area.remove_jukebox_vote(client, True)
 		for a in self.server.area_manager.areas:
@@ -1051,9 +1300,6 @@ class ClientManager:
 					callarea.owners.clear()
 					client.call = None
 					caller.call = None
-		for c in self.clients:
-			if c.ipid == client.ipid:
-				c.clientscon -= 1
 
 	def get_targets(self, client, key, value, local=False, single=False):
 		"""
@@ -1067,46 +1313,31 @@ class ClientManager:
 		:param local: search in current area only (Default value = False)
 		:param single: search only a single user (Default value = False)
 		"""
-		areas = None
-		if local:
-			areas = [client.area]
-		else:
-			areas = []
-			for a in client.server.area_manager.areas:
-				areas.append(a)
-				if a.is_hub:
-					for sub in a.subareas:
-						areas.append(sub)
-		targets = []
 		if key == TargetType.ALL:
-			for nkey in range(6):
-				targets += self.get_targets(client, nkey, value, local)
-		for area in areas:
-			for client in area.clients:
-				if key == TargetType.IP:
-					if value.lower().startswith(client.ip.lower()):
-						targets.append(client)
-				elif key == TargetType.OOC_NAME:
-					if value.lower().startswith(
-							client.name.lower()) and client.name:
-						targets.append(client)
-				elif key == TargetType.CHAR_NAME:
-					if value.lower().startswith(
-							client.char_name.lower()):
-						targets.append(client)
-				elif key == TargetType.ID:
-					if client.id == value:
-						targets.append(client)
-				elif key == TargetType.IPID:
-					if client.ipid == value:
-						targets.append(client)
-				elif key == TargetType.HDID:
-					if client.hdid == value:
-						targets.append(client)
-				elif key == TargetType.AFK:
-					if client.afk:
-						targets.append(client)
-		return targets
+			targets = []
+			for nkey in (TargetType.OOC_NAME, TargetType.CHAR_NAME,
+					TargetType.ID, TargetType.IPID, TargetType.HDID):
+				for target in self.get_targets(client, nkey, value, local):
+					if target not in targets:
+						targets.append(target)
+			return targets
+		if key == TargetType.ID:
+			target = self.clients_by_id.get(value)
+			targets = [] if target is None else [target]
+		elif key == TargetType.IPID:
+			targets = self.get_multiclients(value)
+		elif key == TargetType.HDID:
+			targets = self.clients_by_hdid.get(value, ())
+		elif key == TargetType.OOC_NAME:
+			targets = self.names.match(value)
+		elif key == TargetType.CHAR_NAME:
+			targets = self.char_names.match(value)
+		elif key == TargetType.IP:
+			targets = [c for c in self.clients
+				if value.lower().startswith(str(c.ip).lower())]
+		else:
+			targets = []
+		return [c for c in targets if not local or c.area == client.area]
 
 	def get_muted_clients(self):
 		"""Get a list of muted clients."""
@@ -6,6 +6,7 @@ import yaml
 
 from heapq import heappop, heappush
 from server import database
+from server.network import schema
 from server.webhooks import Webhooks
 from server.constants import TargetType
 from server.exceptions import ClientError, ServerError, ArgumentError
@@ -44,13 +45,28 @@ __all__ = [
 	'ooc_cmd_addmod',
 	'ooc_cmd_removemod',
 	'ooc_cmd_spy',
-	'ooc_cmd_geoiprefresh'
+	'ooc_cmd_geoiprefresh',
+	'ooc_cmd_protocols'
 ]
 
 def ooc_cmd_geoiprefresh(client, arg):
+	"""
+	Reload the IP range ban list and the GeoIP database.
+	Usage: /geoiprefresh
+	"""
 	if not client.is_admin:
 		raise ArgumentError('You must be authorized to do that.')
 	client.server.load_ipranges()
+	geoip = client.server.geoip
+	stats = geoip.stats
+	if geoip.load():
+		msg = 'GeoIP database reloaded.'
+	else:
+		msg = 'Could not load the GeoIP database, keeping the current one.'
+	msg += f'\nIP range bans: {len(client.server.ipRange_bans)} entries.'
+	msg += f'\nASN cache: {stats["hits"]} hits, {stats["misses"]} misses ' \
+		f'({stats["hit_rate"]:.0%} hit rate), {stats["size"]} cached.'
+	client.send_ooc(msg)
 
 def ooc_cmd_spy(client, arg):
 	if not client.is_mod:
@@ -602,6 +618,22 @@ def ooc_cmd_login(client, arg):
 	#client.send_ooc('Logged in as a moderator.')
 	#database.log_misc('login', client, data={'profile': login_name})
 
+@mod_only()
+def ooc_cmd_protocols(client, arg):
+	"""
+	Show which IC message formats clients use.
+	Usage: /protocols
+	"""
+	if len(arg) > 0:
+		raise ArgumentError('This command takes no arguments.')
+	stats = schema.MS.stats
+	total = sum(stats.values())
+	msg = f'IC messages since startup: {total}'
+	for name, count in stats.items():
+		share = round(count / total * 100) if total > 0 else 0
+		msg += f'\n{name}: {count} ({share}%)'
+	client.send_ooc(msg)
+
 @mod_only()
 def ooc_cmd_refresh(client, arg):
 	"""
@@ -53,8 +53,8 @@ __all__ = [
 
 def ooc_cmd_totalmulticlients(client, arg):
 	"""
-	Show information about all areas.
-	Usage: /getareas
+	Show the number of clients beyond the first of each IPID.
+	Usage: /totalmulticlients
 	"""
 	client.send_area_info(client.area, False, False, True)
 
@@ -204,6 +204,7 @@ def ooc_cmd_rename(client, arg):
 	if len(arg) == 0:
 		if client.area.is_hub:
 			client.area.name = f'Hub {client.area.hubid}'
+			client.server.area_manager.index_areas()
 			area_list = []
 			lobby = client.server.area_manager.default_area()
 			area_list.append(lobby.name)
@@ -226,6 +227,7 @@ def ooc_cmd_rename(client, arg):
 				raise ArgumentError('Try to exclude special characters while renaming.')
 	if client.area.is_hub:
 		client.area.name = f'Hub {client.area.hubid}: {arg}'
+		client.server.area_manager.index_areas()
 		area_list = []
 		lobby = client.server.area_manager.default_area()
 		area_list.append(lobby.name)
@@ -238,12 +240,10 @@ def ooc_cmd_rename(client, arg):
 		for area in client.server.area_manager.areas:
 			area_list.append(area.name)
 		client.server.send_all_cmd_pred('FA', *area_list, pred=lambda x: not x.area.is_hub and not x.area.sub)
-		client.server.area_manager.send_arup_cms()
-		client.server.area_manager.send_arup_players()
-		client.server.area_manager.send_arup_lock()
-		client.server.area_manager.send_arup_status()
+		client.server.area_manager.refresh_arup()
 	else:
 		client.area.name = arg
+		client.server.area_manager.index_areas()
 		area_list = []
 		lobby = client.server.area_manager.default_area()
 		area_list.append(lobby.name)
@@ -71,11 +71,13 @@ def ooc_cmd_addmusic(client, arg):
 			mlist[-1]['songs'].append({'name': args[0], 'length': length})
 		else:
 			mlist[-1]['songs'].append({'name': args[0], 'length': length})
+		client.area.update_cmusic_catalogs()
 		client.area.broadcast_ooc(f'{args[0]} added to the music list.')
 		music = client.area.get_music(client)
 		if client.area.is_hub:
 			for sub in client.area.subareas:
-				sub.cmusic_list = mlist
+				if sub.cmusic_list is not mlist:
+					sub.cmusic_list = mlist
 			client.server.send_all_cmd_pred('FM', *music, pred=lambda x: x.area == client.area or x.area.hub == client.area)
 		else:
 			client.server.send_all_cmd_pred('FM', *music, pred=lambda x: x.area == client.area)
@@ -91,10 +93,12 @@ def ooc_cmd_addcategory(client, arg):
 	songs = []
 	mlist.append({'category': arg})
 	mlist[-1]['songs'] = songs
+	client.area.update_cmusic_catalogs()
 	music = client.area.get_music(client)
 	if client.area.is_hub:
 		for sub in client.area.subareas:
-			sub.cmusic_list = mlist
+			if sub.cmusic_list is not mlist:
+				sub.cmusic_list = mlist
 		client.server.send_all_cmd_pred('FM', *music, pred=lambda x: x.area == client.area or x.area.hub == client.area)
 	else:
 		client.server.send_all_cmd_pred('FM', *music, pred=lambda x: x.area == client.area)
@@ -352,26 +356,14 @@ def ooc_cmd_playrandom(client, arg):
 	"""
 	if len(arg) > 0:
 		raise ArgumentError('This command takes no arguments.')
-	index = 0
-	for item in client.server.music_list:
-		for song in item['songs']:
-			index += 1
-	if index == 0:
+	songs = client.server.music_catalog.songs
+	if len(songs) == 0:
 		raise ServerError(
 				'No music found.')
-	else:
-		music_set = set(range(index))
-		trackid = random.choice(tuple(music_set))
-		index = 1
-		for item in client.server.music_list:
-			for song in item['songs']:
-				if index == trackid:
-					client.area.play_music(song['name'], client.char_id, song['length'])
-					client.area.add_music_playing(client, song['name'])
-					database.log_room('play', client, client.area, message=song['name'])
-					return
-				else:
-					index += 1
+	song = random.choice(songs)
+	client.area.play_music(song.name, client.char_id, song.length)
+	client.area.add_music_playing(client, song.name)
+	database.log_room('play', client, client.area, message=song.name)
 
 def ooc_cmd_shuffle(client, arg):
     """
@@ -2,7 +2,6 @@ import random
 import re
 import time
 import threading
-import asyncio
 import arrow
 import datetime
 import pytimeparse
@@ -11,6 +10,7 @@ from server import database
 from server.party import Party, Vote
 from server.constants import TargetType
 from server.exceptions import ClientError, ServerError, ArgumentError
+from server.timer_wheel import timers
 
 from . import mod_only
 
@@ -1122,5 +1122,5 @@ def ooc_cmd_timer(client, arg):
 		if timer.schedule:
 			timer.schedule.cancel()
 		if timer.started:
-			timer.schedule = asyncio.get_event_loop().call_later(
+			timer.schedule = timers.call_later(
 				int(timer.static.total_seconds()), timer_expired)
\ No newline at end of file
@@ -19,8 +19,10 @@
 
 import os
 
-import asyncio
+import queue
 import sqlite3
+import threading
+import time
 import json
 
 import arrow
@@ -35,6 +37,7 @@ from functools import reduce
 from textwrap import dedent
 
 from .exceptions import ServerError
+from .timer_wheel import timers
 
 
 DB_FILE = 'storage/db.sqlite3'
@@ -61,6 +64,48 @@ class Database:
         if new:
             self.migrate_json_to_v1()
         self.migrate()
+        # WAL lets the log writer commit without blocking reads on
+        # the main connection.
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.writer = Writer(DB_FILE)
+        self.writer.start()
+        self.ip_ipids = {}
+        # IPIDs allocated since startup, whose rows may still be queued
+        self.new_ipids = {}
+        self.next_ipid = 1
+        self.load_ipids()
+        self.bans = BanIndex()
+        self.hdids = set()
+        self.load_bans()
+
+    def load_ipids(self):
+        """
+        Load the IP to IPID map into memory, so that connections are
+        assigned an IPID without querying the database.
+        """
+        with self.db as conn:
+            self.ip_ipids = {row['ip_address']: row['ipid'] for row in
+                conn.execute('SELECT ipid, ip_address FROM ipids')}
+        self.next_ipid = max(self.ip_ipids.values(), default=0) + 1
+        logger.debug(f'Loaded {len(self.ip_ipids)} IPIDs')
+
+    def load_bans(self):
+        """
+        Load every ban and known HDID into memory, so that handshakes
+        are checked without querying the database.
+        """
+        bans = BanIndex()
+        with self.db as conn:
+            for row in conn.execute('SELECT * FROM bans'):
+                bans.add(Database.Ban(**row))
+            for row in conn.execute('SELECT ipid, ban_id FROM ip_bans'):
+                bans.link_ipid(row['ipid'], row['ban_id'])
+            for row in conn.execute('SELECT hdid, ban_id FROM hdid_bans'):
+                bans.link_hdid(row['hdid'], row['ban_id'])
+            self.hdids = {(row['hdid'], row['ipid']) for row in
+                conn.execute('SELECT hdid, ipid FROM hdids')}
+        self.bans = bans
+        logger.debug(f'Loaded {len(bans)} bans and {len(self.hdids)} HDIDs')
 
     def migrate_json_to_v1(self):
         """Migrate to v1 of the database from JSON."""
@@ -152,24 +197,44 @@ class Database:
         logger.debug(f'Migration to v{version} complete')
 
     def ipid(self, ip):
-        """Get an IPID from an IP address."""
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT OR IGNORE INTO ipids(ipid, ip_address) VALUES (NULL, ?)
-                '''), (ip, ))
-            ipid = conn.execute(dedent('''
-                SELECT ipid FROM ipids WHERE ip_address = ?
-                '''), (ip, )).fetchone()['ipid']
+        """
+        Get an IPID from an IP address. New IPIDs are allocated in
+        memory and written to the database in the background.
+        """
+        ipid = self.ip_ipids.get(ip)
+        if ipid is None:
+            ipid = self.ip_ipids[ip] = self.next_ipid
+            self.new_ipids[ipid] = ip
+            self.next_ipid += 1
             event_logger.info(f'IPID for {ip}: {ipid}')
-            return ipid
+            self.writer.put(dedent('''
+                INSERT OR IGNORE INTO ipids(ipid, ip_address) VALUES (?, ?)
+                '''), (ipid, ip))
+        return ipid
+
+    def save_ipids(self, conn, *ipids):
+        """
+        Write the rows of IPIDs that may still be queued in the writer,
+        so that they can be referenced in the current transaction.
+        :param conn: connection of the transaction
+        :param ipids: IPIDs to write
+        """
+        for ipid in ipids:
+            ip = self.new_ipids.get(ipid)
+            if ip is not None:
+                conn.execute(dedent('''
+                    INSERT OR IGNORE INTO ipids(ipid, ip_address) VALUES (?, ?)
+                    '''), (ipid, ip))
 
     def add_hdid(self, ipid, hdid):
         """Associate an HDID with an IPID."""
-        with self.db as conn:
-            event_logger.info(f'Associated {ipid} with {hdid}')
-            conn.execute(dedent('''
-                INSERT OR IGNORE INTO hdids(hdid, ipid) VALUES (?, ?)
-                '''), (hdid, ipid))
+        event_logger.info(f'Associated {ipid} with {hdid}')
+        if (hdid, ipid) in self.hdids:
+            return
+        self.hdids.add((hdid, ipid))
+        self.writer.put(dedent('''
+            INSERT OR IGNORE INTO hdids(hdid, ipid) VALUES (?, ?)
+            '''), (hdid, ipid))
 
     def ban(self,
             target_id,
@@ -183,14 +248,24 @@ class Database:
         These should be used sparingly, as they can affect large swaths
         of web users if used incorrectly.
         """
+        # Linking to a ban that was lifted
+        if ban_id is not None and self.bans.get(ban_id) is None:
+            raise ServerError(f'Error inserting ban: ban {ban_id} does not exist')
+        new_ban = None
         with self.db as conn:
+            if ban_type == 'ipid':
+                self.save_ipids(conn, target_id)
             if ban_id is None:
                 event_logger.info(f'{banned_by.name} ({banned_by.ipid}) ' +
                                   f'banned {target_id}: \'{reason}\'.')
+                self.save_ipids(conn, banned_by.ipid)
                 ban_id = conn.execute(dedent('''
                     INSERT INTO bans(reason, banned_by, unban_date)
                     VALUES (?, ?, ?)
                     '''), (reason, banned_by.ipid, unban_date)).lastrowid
+                new_ban = Database.Ban(**conn.execute(dedent('''
+                    SELECT * FROM bans WHERE ban_id = ?
+                    '''), (ban_id,)).fetchone())
             if ban_type == 'ipid':
                 try:
                     conn.execute(dedent('''
@@ -209,6 +284,14 @@ class Database:
             else:
                 raise ServerError(f'unknown ban type {ban_type}')
 
+        # Only index the ban once it is committed
+        if new_ban is not None:
+            self.bans.add(new_ban)
+        if ban_type == 'ipid':
+            self.bans.link_ipid(target_id, ban_id)
+        else:
+            self.bans.link_hdid(target_id, ban_id)
+
         if unban_date is not None:
             self._schedule_unban(ban_id)
 
@@ -226,6 +309,7 @@ class Database:
             if warn_id is None:
                 event_logger.info(f'{warned_by.name} ({warned_by.ipid}) ' +
                                   f'warned {target.ipid}: \'{reason}\'.')
+                self.save_ipids(conn, target.ipid, warned_by.ipid)
                 warn_id = conn.execute(dedent('''
                     INSERT INTO warns(reason, warned_by)
                     VALUES (?, ?)
@@ -262,7 +346,8 @@ class Database:
 
         def __post_init__(self):
             self.ban_date = arrow.get(self.ban_date).datetime
-            self.unban_date = arrow.get(self.unban_date).datetime
+            if self.unban_date is not None:
+                self.unban_date = arrow.get(self.unban_date).datetime
 
         @property
         def ipids(self):
@@ -324,40 +409,23 @@ class Database:
 
     def find_ban(self, ipid=None, hdid=None, ban_id=None):
         """Check if an IPID and/or HDID are banned."""
-        with self.db as conn:
-            # Why is this query so complicated? The answer is that I am
-            # offloading most of the work to SQLite. This query first
-            # finds HDID or IPID bans, then looks up the associated ban
-            # information. Then it finds the last known OOC name of the
-            # player who issued that ban, purely as a convenience
-            # for later use. Use `EXPLAIN QUERY PLAN` for a breakdown.
-            #   LEFT OUTER JOIN room_events ON
-            #      room_events.ipid = banned_by AND
-            #      ooc_name IS NOT NULL
-            #   ORDER BY event_time DESC LIMIT 1
-            ban = conn.execute(dedent('''
-                SELECT *
-                FROM (
-                    SELECT ban_id FROM ip_bans WHERE ipid = ?
-                    UNION SELECT ban_id FROM hdid_bans WHERE hdid = ?
-                    UNION SELECT ban_id FROM bans WHERE ban_id = ?
-                )
-                JOIN bans USING (ban_id)
-                '''), (ipid, hdid, ban_id)).fetchone()
-            if ban is not None:
-                return Database.Ban(**ban)
-            else:
-                return None
+        return self.bans.find(ipid, hdid, ban_id)
 
     def unban(self, ban_id):
         """Remove a ban entry."""
         event_logger.info(f'Unbanning {ban_id}')
+        ban = self.bans.get(ban_id)
+        if ban is None:
+            return False
+        # Deleted right away, so that the same targets can be banned
+        # again. ip_bans and hdid_bans entries are deleted in cascade.
         with self.db as conn:
-            unbans = conn.execute(dedent('''
+            conn.execute(dedent('''
                 DELETE FROM bans WHERE ban_id = ?
-                '''), (ban_id,)).rowcount
-            return unbans > 0
-        
+                '''), (ban.ban_id,))
+        self.bans.remove(ban.ban_id)
+        return True
+
     def find_warn(self, warn_id):
         """Get the warn entry matching the given warn ID."""
         #TODO: this should not be a for loop
@@ -404,47 +472,36 @@ class Database:
 
     def schedule_unbans(self):
         """
-        Schedule unbans from the database.
-
-        There is a bug in Python 3.7 and below where functions cannot be
-        scheduled with a timeout longer than one day. As a workaround,
-        schedule_unbans will only get the unbans for the next 12 hours
-        and then will have to be called again 12 hours later.
+        Schedule the unbans due in the next 12 hours. Called again every
+        12 hours, so that unbans are never scheduled days in advance.
         """
-        dated_bans = []
-        with self.db as conn:
-            dated_bans = conn.execute(dedent('''
-                SELECT ban_id FROM bans
-                WHERE unban_date IS NOT NULL AND
-                    datetime(unban_date) < datetime(?, '+12 hours')
-                '''), (arrow.utcnow().datetime,)).fetchall()
-
-        for ban in dated_bans:
-            self._schedule_unban(ban['ban_id'])
+        horizon = arrow.utcnow().shift(hours=12)
+        for ban in list(self.bans.bans.values()):
+            if ban.unban_date is not None and arrow.get(ban.unban_date) < horizon:
+                self._schedule_unban(ban.ban_id)
 
     def _schedule_unban(self, ban_id):
-        with self.db as conn:
-            ban = conn.execute(dedent('''
-                SELECT unban_date FROM bans WHERE ban_id = ?
-                '''), (ban_id,)).fetchone()
-            time_to_unban = (arrow.get(ban['unban_date']) - arrow.utcnow()).total_seconds()
+        ban = self.bans.get(ban_id)
+        time_to_unban = (arrow.get(ban.unban_date) - arrow.utcnow()).total_seconds()
 
-            def auto_unban():
-                self.unban(ban_id)
-                self.log_misc('auto_unban', data={'id': ban_id})
+        def auto_unban():
+            # Lifted by hand, or already scheduled by an earlier pass
+            if self.bans.get(ban_id) is not ban:
+                return
+            self.unban(ban_id)
+            self.log_misc('auto_unban', data={'id': ban_id})
 
-            asyncio.get_event_loop().call_later(time_to_unban, auto_unban)
+        timers.call_later(time_to_unban, auto_unban)
 
     def log_ic(self, client, room, showname, message):
         """Log an IC message."""
         event_logger.info(f'[{room.abbreviation}] {showname}/{client.char_name}' +
                           f'/{client.name} ({client.ipid}): {message}')
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO ic_events(ipid, room_name, char_name, ic_name,
-                    message) VALUES (?, ?, ?, ?, ?)
-                '''), (client.ipid, room.abbreviation, client.char_name,
-                    showname, message))
+        self.writer.put(dedent('''
+            INSERT INTO ic_events(ipid, room_name, char_name, ic_name,
+                message) VALUES (?, ?, ?, ?, ?)
+            '''), (client.ipid, room.abbreviation, client.char_name,
+                showname, message))
 
     def log_room(self, event_subtype, client, room, message=None, target=None):
         """
@@ -455,28 +512,25 @@ class Database:
                                      client.name) if client is not None else (
                                          None, None, None)
         target_ipid = target.ipid if target is not None else None
-        subtype_id = self._subtype_atom('room', event_subtype)
         if isinstance(message, dict):
             message = json.dumps(message)
 
-        event_logger.info(f'[{room.abbreviation}] {client.char_name}' +
-                    f'/{client.name} ({client.ipid}): event {event_subtype} ({message})')
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO room_events(ipid, room_name, char_name, ooc_name,
-                    event_subtype, message, target_ipid)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                '''), (ipid, room.abbreviation, char_name, ooc_name,
-                    subtype_id, message, target_ipid))
+        event_logger.info(f'[{room.abbreviation}] {char_name}' +
+                    f'/{ooc_name} ({ipid}): event {event_subtype} ({message})')
+        self.writer.put(dedent('''
+            INSERT INTO room_events(ipid, room_name, char_name, ooc_name,
+                message, target_ipid, event_subtype)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            '''), (ipid, room.abbreviation, char_name, ooc_name,
+                message, target_ipid), atom=('room', event_subtype))
 
     def log_connect(self, client, failed=False):
         """Log a connect attempt."""
         event_logger.info(f'{client.ipid} (HDID: {client.hdid}) ' +
                           f'{"was blocked from connecting" if failed else "connected"}.')
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO connect_events(ipid, hdid, failed) VALUES (?, ?, ?)
-                '''), (client.ipid, client.hdid, failed))
+        self.writer.put(dedent('''
+            INSERT INTO connect_events(ipid, hdid, failed) VALUES (?, ?, ?)
+            '''), (client.ipid, client.hdid, failed))
 
     def log_misc(self, event_subtype, client=None, target=None, data=None):
         """
@@ -485,15 +539,14 @@ class Database:
         """
         client_ipid = client.ipid if client is not None else None
         target_ipid = target.ipid if target is not None else None
-        subtype_id = self._subtype_atom('misc', event_subtype)
         data_json = json.dumps(data)
         event_logger.info(f'{event_subtype} ({client_ipid} onto {target_ipid}): {data}')
 
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO misc_events(ipid, target_ipid, event_subtype,
-                    event_data) VALUES (?, ?, ?, ?)
-                '''), (client_ipid, target_ipid, subtype_id, data_json))
+        self.writer.put(dedent('''
+            INSERT INTO misc_events(ipid, target_ipid, event_data,
+                event_subtype) VALUES (?, ?, ?, ?)
+            '''), (client_ipid, target_ipid, data_json),
+            atom=('misc', event_subtype))
 
     def recent_bans(self, count=5):
         """
@@ -508,16 +561,237 @@ class Database:
                     ORDER BY ban_date ASC
                     '''), (count,)).fetchall()]
 
-    def _subtype_atom(self, event_type, event_subtype):
-        if event_type not in ('room', 'misc'):
-            raise AssertionError()
 
-        with self.db as conn:
-            conn.execute(dedent(f'''
-                INSERT OR IGNORE INTO {event_type}_event_types(type_name)
-                VALUES (?)
-                '''), (event_subtype,))
-            return conn.execute(dedent(f'''
-                SELECT type_id FROM {event_type}_event_types
-                WHERE type_name = ?
-                '''), (event_subtype,)).fetchone()['type_id']
+def _subtype_atom(conn, event_type, event_subtype):
+    """
+    Translate an event subtype to its enum value, creating one if
+    necessary. This runs in the caller's transaction.
+    """
+    if event_type not in ('room', 'misc'):
+        raise AssertionError()
+
+    conn.execute(dedent(f'''
+        INSERT OR IGNORE INTO {event_type}_event_types(type_name)
+        VALUES (?)
+        '''), (event_subtype,))
+    return conn.execute(dedent(f'''
+        SELECT type_id FROM {event_type}_event_types
+        WHERE type_name = ?
+        '''), (event_subtype,)).fetchone()[0]
+
+
+def _as_int(value):
+    """Convert an ID typed in by a moderator, or None if it is not one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class BanIndex:
+    """
+    In-memory copy of the ban tables. An IPID or HDID is covered by at
+    most one ban, as in the ip_bans and hdid_bans tables.
+    """
+
+    def __init__(self):
+        self.bans = {}
+        self.by_ipid = {}
+        self.by_hdid = {}
+        # ban_id -> (IPIDs, HDIDs) it covers
+        self.targets = {}
+
+    def __len__(self):
+        return len(self.bans)
+
+    def add(self, ban):
+        """Add a ban entry, not yet covering anyone."""
+        self.bans[ban.ban_id] = ban
+        self.targets.setdefault(ban.ban_id, (set(), set()))
+
+    def link_ipid(self, ipid, ban_id):
+        """Cover an IPID by a ban."""
+        self.link(self.by_ipid, 0, ipid, ban_id)
+
+    def link_hdid(self, hdid, ban_id):
+        """Cover an HDID by a ban."""
+        self.link(self.by_hdid, 1, hdid, ban_id)
+
+    def link(self, index, kind, target, ban_id):
+        """
+        Cover a target by a ban, in one of the target indexes.
+        :param index: by_ipid or by_hdid
+        :param kind: position of the index in the targets of a ban
+        """
+        if ban_id not in self.bans:
+            return
+        old = index.get(target)
+        if old is not None and old in self.targets:
+            self.targets[old][kind].discard(target)
+        index[target] = ban_id
+        self.targets[ban_id][kind].add(target)
+
+    def get(self, ban_id):
+        """Get a ban entry by ID, or None."""
+        return self.bans.get(_as_int(ban_id))
+
+    def remove(self, ban_id):
+        """
+        Remove a ban entry and everything it covers.
+        :returns: the removed ban, or None if there was none
+        """
+        ban = self.bans.pop(_as_int(ban_id), None)
+        if ban is None:
+            return None
+        ipids, hdids = self.targets.pop(ban.ban_id)
+        for ipid in ipids:
+            del self.by_ipid[ipid]
+        for hdid in hdids:
+            del self.by_hdid[hdid]
+        return ban
+
+    def find(self, ipid=None, hdid=None, ban_id=None):
+        """
+        Find a ban covering an IPID or HDID, or by its ID. If several
+        match, the oldest ban is returned.
+        """
+        matches = [self.by_ipid.get(_as_int(ipid)), self.by_hdid.get(hdid),
+            _as_int(ban_id)]
+        matches = [match for match in matches if match in self.bans]
+        if not matches:
+            return None
+        return self.bans[min(matches)]
+
+
+class Writer(threading.Thread):
+    """
+    Background thread that owns its own SQLite connection and commits
+    queued log inserts in batches, so that logging never waits on disk
+    I/O in the event loop.
+
+    A batch is committed once `batch_size` rows are pending or
+    `interval` seconds have passed since the first pending row,
+    whichever comes first.
+    """
+
+    def __init__(self, path, interval=0.25, batch_size=128, queue_size=8192):
+        super().__init__(name='database-writer', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.atoms = {}
+
+        # Backpressure metrics
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.stalls = 0
+        self.high_water = 0
+
+    def put(self, sql, params, atom=None):
+        """
+        Queue an insert.
+        :param sql: statement to execute
+        :param params: statement parameters
+        :param atom: (event_type, event_subtype) whose enum value is
+        appended to the parameters by the writer (Default value = None)
+        """
+        item = (sql, params, atom)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # The disk cannot keep up. Block rather than drop logs,
+            # but keep count so that it shows up in the stats.
+            self.stalls += 1
+            self.queue.put(item)
+        self.enqueued += 1
+        self.high_water = max(self.high_water, self.queue.qsize())
+
+    def flush(self):
+        """Block until every queued insert has been committed."""
+        if self.is_alive():
+            self.queue.join()
+
+    def stop(self, timeout=10):
+        """Commit any pending inserts and stop the writer."""
+        if not self.is_alive():
+            return
+        self.queue.put(None)
+        self.join(timeout)
+        logger.debug(f'Database writer stopped: {self.stats}')
+
+    @property
+    def stats(self):
+        return {
+            'pending': self.queue.qsize(),
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+            'stalls': self.stalls,
+            'high_water': self.high_water
+        }
+
+    def run(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.task_done()
+                    running = False
+                    break
+                batch.append(item)
+            self.write(conn, batch)
+            for _ in batch:
+                self.queue.task_done()
+        conn.close()
+
+    def write(self, conn, batch):
+        """
+        Commit a batch in a single transaction. If the transaction fails,
+        retry the rows one by one so that a single bad row does not take
+        the rest of the batch with it.
+        """
+        try:
+            with conn:
+                for sql, params, atom in batch:
+                    conn.execute(sql, self.params(conn, params, atom))
+            self.written += len(batch)
+        except sqlite3.Error:
+            # Subtypes created in the rolled back transaction are gone
+            self.atoms = {}
+            for sql, params, atom in batch:
+                try:
+                    with conn:
+                        conn.execute(sql, self.params(conn, params, atom))
+                    self.written += 1
+                except sqlite3.Error as exc:
+                    self.atoms = {}
+                    self.failed += 1
+                    logger.debug(f'Dropped log entry ({exc}): {params}')
+        self.batches += 1
+
+    def params(self, conn, params, atom):
+        if atom is None:
+            return params
+        if atom not in self.atoms:
+            self.atoms[atom] = _subtype_atom(conn, *atom)
+        return params + (self.atoms[atom],)
@@ -23,27 +23,33 @@ An awful encryption scheme from another era.
 
 # fantacrypt was a mistake, just hardcoding some numbers is good enough
 
-import binascii
+from functools import lru_cache
 
 CRYPT_CONST_1 = 53761
 CRYPT_CONST_2 = 32618
 CRYPT_KEY = 5
 
 
+@lru_cache(maxsize=256)
 def fanta_decrypt(data):
     """
     Decrypt data.
+    Only a handful of distinct headers are ever encrypted, so results
+    are cached.
     :param data: hex string
 
     """
-    data_bytes = [int(data[x:x + 2], 16) for x in range(0, len(data), 2)]
+    if len(data) % 2:
+        # A trailing lone digit is a byte of its own
+        data = data[:-1] + '0' + data[-1]
+    data_bytes = bytes.fromhex(data)
+    ret = bytearray(len(data_bytes))
     key = CRYPT_KEY
-    ret = ''
-    for byte in data_bytes:
-        val = byte ^ ((key & 0xffff) >> 8)
-        ret += chr(val)
-        key = ((byte + key) * CRYPT_CONST_1) + CRYPT_CONST_2
-    return ret
+    for i, byte in enumerate(data_bytes):
+        ret[i] = byte ^ (key >> 8)
+        # Only the low 16 bits of the key are ever used
+        key = ((byte + key) * CRYPT_CONST_1 + CRYPT_CONST_2) & 0xffff
+    return ret.decode('latin-1')
 
 
 def fanta_encrypt(data):
@@ -52,11 +58,10 @@ def fanta_encrypt(data):
     :param data: message string
     :returns: hex-encoded message
     """
+    data_bytes = data.encode('latin-1')
+    ret = bytearray(len(data_bytes))
     key = CRYPT_KEY
-    ret = ''
-    for char in data:
-        val = ord(char) ^ ((key & 0xffff) >> 8)
-        ret += binascii.hexlify(val.to_bytes(
-            1, byteorder='big')).decode().upper()
-        key = ((val + key) * CRYPT_CONST_1) + CRYPT_CONST_2
-    return ret
+    for i, byte in enumerate(data_bytes):
+        val = ret[i] = byte ^ (key >> 8)
+        key = ((val + key) * CRYPT_CONST_1 + CRYPT_CONST_2) & 0xffff
+    return ret.hex().upper()
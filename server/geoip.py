@@ -0,0 +1,186 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import geoip2.database
+import geoip2.errors
+import maxminddb
+
+import logging
+logger = logging.getLogger('debug')
+
+# ASN reported for addresses that are not in the database, or when no
+# database is installed
+NO_ASN = 'Loopback'
+
+
+class ASNResolver:
+	"""
+	Resolves client IP addresses to ASNs through the GeoLite2 ASN
+	database, with an LRU cache of recent results.
+
+	Misses can be resolved on a worker thread with lookup_async, so that
+	reading the database never blocks the event loop.
+	"""
+
+	def __init__(self, path, cache_size=4096, ttl=3600):
+		"""
+		:param path: path to the GeoLite2 ASN database
+		:param cache_size: maximum number of cached addresses
+		:param ttl: seconds a cached result stays valid
+		"""
+		self.path = path
+		self.cache_size = cache_size
+		self.ttl = ttl
+		self.cache = OrderedDict()
+		self.reader = None
+		# One worker, so that a replaced reader is only closed once the
+		# lookups queued before it are done
+		self.executor = ThreadPoolExecutor(max_workers=1,
+			thread_name_prefix='geoip')
+
+		self.hits = 0
+		self.misses = 0
+		self.expired = 0
+		self.reloads = 0
+
+	@property
+	def enabled(self):
+		"""Whether a database is loaded."""
+		return self.reader is not None
+
+	def load(self):
+		"""
+		Open the database, memory-mapped, and swap it in for the current
+		one. Cached results are dropped.
+		:returns: False if the database could not be opened, in which
+		case the current one is kept
+		"""
+		try:
+			reader = geoip2.database.Reader(self.path, mode=maxminddb.MODE_MMAP)
+		except (FileNotFoundError, maxminddb.InvalidDatabaseError) as exc:
+			logger.debug(f'Cannot load GeoIP database {self.path}: {exc}')
+			return False
+		old, self.reader = self.reader, reader
+		self.cache = OrderedDict()
+		self.reloads += 1
+		if old is not None:
+			self.executor.submit(old.close)
+		return True
+
+	def close(self):
+		"""Close the database and stop the worker thread."""
+		if self.reader is not None:
+			self.executor.submit(self.reader.close)
+			self.reader = None
+		self.executor.shutdown(wait=False)
+
+	@property
+	def stats(self):
+		lookups = max(self.hits + self.misses, 1)
+		return {
+			'size': len(self.cache),
+			'hits': self.hits,
+			'misses': self.misses,
+			'expired': self.expired,
+			'hit_rate': self.hits / lookups,
+			'reloads': self.reloads
+		}
+
+	def get_cached(self, ip):
+		"""
+		Get the cached ASN of an address.
+		:param ip: IP address
+		:returns: ASN as a string, or None if it is not cached
+		"""
+		if self.reader is None:
+			return NO_ASN
+		entry = self.cache.get(ip)
+		if entry is None:
+			self.misses += 1
+			return None
+		asn, expires = entry
+		if expires < time.monotonic():
+			del self.cache[ip]
+			self.expired += 1
+			self.misses += 1
+			return None
+		self.cache.move_to_end(ip)
+		self.hits += 1
+		return asn
+
+	def store(self, ip, asn):
+		"""Cache the ASN of an address, evicting the oldest entry if full."""
+		self.cache[ip] = (asn, time.monotonic() + self.ttl)
+		self.cache.move_to_end(ip)
+		if len(self.cache) > self.cache_size:
+			self.cache.popitem(last=False)
+
+	def resolve(self, reader, ip):
+		"""Read the ASN of an address from the database."""
+		try:
+			return str(reader.asn(ip).autonomous_system_number)
+		except (geoip2.errors.AddressNotFoundError, ValueError):
+			return NO_ASN
+
+	def lookup(self, ip):
+		"""
+		Get the ASN of an address, reading the database on a miss.
+		:param ip: IP address
+		:returns: ASN as a string
+		"""
+		asn = self.get_cached(ip)
+		if asn is None:
+			asn = self.resolve(self.reader, ip)
+			self.store(ip, asn)
+		return asn
+
+	async def lookup_async(self, ip):
+		"""
+		Get the ASN of an address, reading the database on the worker
+		thread on a miss.
+		:param ip: IP address
+		:returns: ASN as a string
+		"""
+		asn = self.get_cached(ip)
+		if asn is None:
+			asn = await self.resolve_async(ip)
+		return asn
+
+	async def resolve_async(self, ip):
+		"""
+		Read the ASN of an address on the worker thread and cache it,
+		without probing the cache first. Use it after get_cached missed,
+		so that the miss is only counted once.
+		:param ip: IP address
+		:returns: ASN as a string
+		"""
+		reader = self.reader
+		if reader is None:
+			return NO_ASN
+		asn = await asyncio.get_event_loop().run_in_executor(
+			self.executor, self.resolve, reader, ip)
+		# Drop results read from a database swapped out meanwhile
+		if reader is self.reader:
+			self.store(ip, asn)
+		return asn
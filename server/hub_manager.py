@@ -85,6 +85,7 @@ class HubManager:
 					area.connections.append(client.area)
 				if lobby not in area.connections:
 					area.connections.append(lobby)
+			self.server.area_manager.index_areas()
 			area_list = []
 			lobby = self.server.area_manager.default_area()
 			area_list.append(lobby.name)
@@ -164,6 +165,7 @@ class HubManager:
 				sub.abbreviation = f'H{hub.hubid}S{sub.id}'
 			hub.subareas.append(sub)
 			hub.cur_subid += 1
+		self.server.area_manager.index_areas()
 		area_list = []
 		lobby = self.server.area_manager.default_area()
 		area_list.append(lobby.name)
@@ -190,6 +192,7 @@ class HubManager:
 					dc.send_ooc(f'You were moved to {hub.name} because the hub was cleared.')
 		hub.subareas.clear()
 		hub.cur_subid = 1
+		self.server.area_manager.index_areas()
 		area_list = []
 		lobby = client.server.area_manager.default_area()
 		area_list.append(lobby.name)
@@ -279,6 +282,7 @@ class HubManager:
 			for owner in client.area.hub.owners:
 				newsub.owners.append(owner)
 		newsub.status = client.area.status
+		self.server.area_manager.index_areas()
 		if not more:
 			area_list = []
 			lobby = client.server.area_manager.default_area()
@@ -0,0 +1,142 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import ipaddress
+
+# Key of the line number in a prefix trie node, which cannot clash with
+# a character of an address
+LINE = None
+
+
+class IPRangeBans:
+	"""
+	Compiled list of banned IP ranges, as read from iprange_ban.txt.
+
+	Each line of the list is one of:
+	 - a CIDR range, such as 192.0.2.0/24 or 2001:db8::/32
+	 - a textual prefix of an address, such as 185.220.10
+	 - an ASN, such as 20473 or AS20473
+	Lines starting with # are comments.
+
+	Prefixes are stored in a character trie, walked once along the
+	address, and CIDR ranges in a set of networks per prefix length.
+	A match reports the first matching line, as a ban ID.
+	"""
+
+	def __init__(self, lines=()):
+		"""
+		:param lines: lines of the ban list
+		"""
+		self.prefixes = {}
+		self.networks = {4: {}, 6: {}}
+		self.asns = {}
+		self.count = 0
+		self.compile(lines)
+
+	def __len__(self):
+		"""Get the number of ranges and ASNs in the list."""
+		return self.count
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Compile a ban list file.
+		:param path: path to the file
+		"""
+		with open(path, 'r', encoding='utf-8') as ipranges:
+			return cls(ipranges.read().splitlines())
+
+	def compile(self, lines):
+		"""
+		Rebuild the matcher from the lines of a ban list.
+		:param lines: lines of the ban list
+		"""
+		prefixes = {}
+		networks = {4: {}, 6: {}}
+		asns = {}
+		count = 0
+		for line, entry in enumerate(lines):
+			if entry == '' or entry.startswith('#'):
+				continue
+			count += 1
+			if '/' in entry:
+				try:
+					network = ipaddress.ip_network(entry.strip(), strict=False)
+				except ValueError:
+					continue
+				by_length = networks[network.version].setdefault(
+					network.prefixlen, {})
+				by_length.setdefault(int(network.network_address), line)
+				continue
+			asn = entry[2:] if entry[:2].upper() == 'AS' else entry
+			asns.setdefault(asn, line)
+			node = prefixes
+			for char in entry:
+				node = node.setdefault(char, {})
+			node.setdefault(LINE, line)
+		self.prefixes = prefixes
+		self.networks = networks
+		self.asns = asns
+		self.count = count
+
+	def match_prefix(self, address):
+		"""Get the first line that is a prefix of the address, or None."""
+		match = None
+		node = self.prefixes
+		for char in address:
+			node = node.get(char)
+			if node is None:
+				break
+			line = node.get(LINE)
+			if line is not None and (match is None or line < match):
+				match = line
+		return match
+
+	def match_network(self, address):
+		"""Get the first CIDR range containing the address, or None."""
+		if not self.networks[4] and not self.networks[6]:
+			return None
+		try:
+			ip = ipaddress.ip_address(address)
+		except ValueError:
+			return None
+		if ip.version == 6 and ip.ipv4_mapped is not None:
+			ip = ip.ipv4_mapped
+		bits = ip.max_prefixlen
+		value = int(ip)
+		match = None
+		for prefixlen, by_length in self.networks[ip.version].items():
+			line = by_length.get(value >> (bits - prefixlen) << (bits - prefixlen))
+			if line is not None and (match is None or line < match):
+				match = line
+		return match
+
+	def match(self, address, asn=None):
+		"""
+		Check an address against the ban list.
+		:param address: IP address of the client
+		:param asn: ASN of the address, as a string (Default value = None)
+		:returns: line of the first matching entry, or None
+		"""
+		matches = [self.match_prefix(address), self.match_network(address),
+			self.asns.get(asn)]
+		matches = [line for line in matches if line is not None]
+		if not matches:
+			return None
+		return min(matches)
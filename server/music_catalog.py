@@ -0,0 +1,105 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class Track:
+	"""A single entry of a music list."""
+	__slots__ = ('name', 'length', 'mod', 'category', 'custom')
+
+	def __init__(self, name, length, mod, category, custom):
+		self.name = name
+		self.length = length
+		self.mod = mod
+		self.category = category
+		self.custom = custom
+
+
+class MusicCatalog:
+	"""
+	A music list compiled for lookups by track name. Category names
+	resolve to a track of length 0, as they did in the music list.
+	"""
+	# Shortest track, in seconds, that can be looped by a shuffle
+	loop_min_length = 5
+
+	def __init__(self, music_list=None, custom=False):
+		"""
+		:param music_list: music list as loaded from YAML
+		:param custom: whether this is an area's custom music list
+		"""
+		self.custom = custom
+		self.tracks = {}
+		self.songs = []
+		self.loopable = []
+		self.categories = {}
+		self.compile(music_list)
+
+	def compile(self, music_list):
+		"""
+		Rebuild the catalog from a music list. If a name appears more
+		than once, the first entry wins.
+		:param music_list: music list as loaded from YAML
+		"""
+		tracks = {}
+		songs = []
+		loopable = []
+		categories = {}
+		for item in music_list or []:
+			if 'category' not in item:
+				# Custom lists may hold tracks outside of any category
+				category = None
+				items = [item]
+			else:
+				category = item['category']
+				tracks.setdefault(category,
+					Track(category, 0, -1, category, self.custom))
+				items = item.get('songs') or []
+			shuffle = categories.setdefault(category, [])
+			for song in items:
+				track = Track(song['name'], song.get('length', 0),
+					song.get('mod', -1), category, self.custom)
+				tracks.setdefault(track.name, track)
+				songs.append(track)
+				if track.length > self.loop_min_length:
+					loopable.append(track)
+					shuffle.append(track)
+		self.tracks = tracks
+		self.songs = songs
+		self.loopable = loopable
+		self.categories = categories
+
+	def get(self, name):
+		"""
+		Get a track by name.
+		:param name: track or category name
+		:returns: Track, or None if not found
+		"""
+		return self.tracks.get(name)
+
+	def get_loopable(self, category=None):
+		"""
+		Get the tracks that can be looped by a shuffle.
+		:param category: category to pick from, or None for all tracks
+		"""
+		if category is None:
+			return self.loopable
+		return self.categories.get(category, [])
+
+	def __len__(self):
+		return len(self.songs)
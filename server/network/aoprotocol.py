@@ -21,7 +21,6 @@
 import time
 import asyncio
 import re
-import unicodedata
 
 import logging
 
@@ -37,6 +36,9 @@ from server import database
 from server.statements import Statement
 from server.exceptions import ClientError, AreaError, ArgumentError, ServerError
 from server.fantacrypt import fanta_decrypt
+from server.network.framer import Framer
+from server.network import schema
+from server.timer_wheel import timers
 from .. import commands
 
 
@@ -54,31 +56,17 @@ class AOProtocol(asyncio.Protocol):
 		super().__init__()
 		self.server = server
 		self.client = None
-		self.buffer = ''
+		self.framer = Framer()
+		# Variant of each command this client last sent, by command name
+		self.variants = {}
 		self.ping_timeout = None
 
 	def dezalgo(self, input):
 		"""
 		Turns any string into a de-zalgo'd version, with a tolerance to allow for normal diacritic use.
-	
-	
-	
-	
-	
-	
-	
-		The following Unicode blocks are scrubbed:
-		U+0300 - U+036F - COMBINING DIACRITICAL MARKS
-		U+1AB0 - U+1AFF - COMBINING DIACRITICAL MARKS EXTENDED
-		U+1DC0 - U+1DFF - COMBINING DIACRITICAL MARKS SUPPLEMENT
-		U+20D0 - U+20FF - COMBINING DIACRITICAL MARKS FOR SYMBOLS
-		U+FE20 - U+FE2F - COMBINING HALF MARKS
+		See TextPipeline.dezalgo.
 		"""
-	
-		filtered = re.sub('([\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]' +
-						  '{' + re.escape(str(self.server.zalgo_tolerance)) + ',})',
-						  '', input)
-		return filtered
+		return self.server.text_pipeline.dezalgo(input)
 		
 	def data_received(self, data):
 		"""Handles any data received from the network.
@@ -95,16 +83,12 @@ class AOProtocol(asyncio.Protocol):
 		if buf is None:
 			buf = b''
 
-		if not isinstance(buf, str):
-			# try to decode as utf-8, ignore any erroneous characters
-			self.buffer += buf.decode('utf-8', 'ignore')
-		else:
-			self.buffer = buf
-
-		self.buffer = self.buffer.translate({ord(c): None for c in '\0'})
+		if isinstance(buf, str):
+			# WebSocket messages are complete on their own
+			self.framer.clear()
+			buf = buf.encode('utf-8')
 
-		if len(self.buffer) > 8192:
-			self.client.disconnect()
+		self.framer.feed(buf)
 		for msg in self.get_messages():
 			if len(msg) < 2:
 				continue
@@ -119,6 +103,8 @@ class AOProtocol(asyncio.Protocol):
 				self.net_cmd_dispatcher[cmd](self, args)
 			except KeyError:
 				logger_debug.debug(f'Unknown incoming message from {ipid}: {msg}')
+		if self.framer.overflowed:
+			self.client.disconnect()
 
 	def connection_made(self, transport):
 		"""Called upon a new client connecting
@@ -137,7 +123,7 @@ class AOProtocol(asyncio.Protocol):
 			return
 		# Client needs to send CHECK#% within the timeout - otherwise,
 		# it will be automatically dropped.
-		self.ping_timeout = asyncio.get_event_loop().call_later(
+		self.ping_timeout = timers.call_later(
 			self.server.config['timeout'], self.client.disconnect)
 		asyncio.get_event_loop().call_later(0.25, self.client.send_command,
 											'decryptor',
@@ -162,10 +148,9 @@ class AOProtocol(asyncio.Protocol):
 		:return: yields messages
 
 		"""
-		while '#%' in self.buffer:
-			spl = self.buffer.split('#%', 1)
-			self.buffer = spl[1]
-			yield spl[0]
+		for frame in self.framer.frames():
+			# try to decode as utf-8, ignore any erroneous characters
+			yield str(frame, 'utf-8', 'ignore')
 
 	def validate_net_cmd(self, args, *types, needs_auth=True):
 		"""Makes sure the net command's arguments match expectations.
@@ -191,6 +176,26 @@ class AOProtocol(asyncio.Protocol):
 					return False
 		return True
 
+	def parse_net_cmd(self, packet_schema, args, needs_auth=True):
+		"""Parses a net command's arguments against its schema.
+
+		:param packet_schema: schema of the net command
+		:param args: actual arguments to the net command
+		:param needs_auth: whether you need to have chosen a character (Default value = True)
+		:returns: parsed record, or None if the arguments are invalid
+
+		"""
+		if needs_auth and self.client.char_id == -1:
+			return None
+		variant = self.variants.get(packet_schema.command)
+		if variant is None or variant.size != len(args):
+			# First packet of its kind, or the client switched versions
+			variant = packet_schema.detect(args)
+			if variant is None:
+				return None
+			self.variants[packet_schema.command] = variant
+		return packet_schema.parse(args, variant)
+
 	def net_cmd_hi(self, args):
 		"""Handshake.
 		
@@ -208,13 +213,13 @@ class AOProtocol(asyncio.Protocol):
 		ban = database.find_ban(ipid, hdid)
 		if ban is not None:
 			if ban.unban_date is not None:
-				unban_date = arrow.get(ban.unban_date)
+				unban_date = arrow.get(ban.unban_date).humanize()
 			else:
 				unban_date = 'N/A'
 	
 			msg = f'{ban.reason}\r\n'
 			msg += f'ID: {ban.ban_id}\r\n'
-			msg += f'Until: {unban_date.humanize()}'
+			msg += f'Until: {unban_date}'
 	
 			database.log_connect(self.client, failed=True)
 			self.client.send_command('BD', msg)
@@ -230,11 +235,36 @@ class AOProtocol(asyncio.Protocol):
 								 self.server.player_count,
 								 self.server.config['playerlimit'])
 
+	@staticmethod
+	def client_version(args):
+		"""
+		Get the (major, minor) version a client sent in its ID packet.
+		AO2 sends the version after the software name; older clients
+		sent a player ID first.
+		:param args: arguments of the ID packet
+		:returns: version tuple, or None if it cannot be read
+		"""
+		for version in args[1:3]:
+			version = version.split('.')
+			try:
+				return (int(version[0]), int(version[1]))
+			except (IndexError, ValueError):
+				continue
+		return None
+
 	def net_cmd_id(self, args):
 		"""Client version and PV
 		
+		ID#<software:string>#<version:string>#%
 		ID#<pv:int>#<software:string>#<version:string>#%
 		"""
+		version = self.client_version(args)
+		# Expect the IC message format of the client's version,
+		# falling back to detection if it sends something else
+		if version is not None and version >= (2, 8):
+			self.variants['MS'] = schema.MS.by_name['2.8']
+		elif version is not None and version >= (2, 7):
+			self.variants['MS'] = schema.MS.by_name['2.7.0']
 		self.client.send_command('FL', 'yellowtext', 'customobjections', 
 								 'flipping', 'fastloading', 'noencryption',
 								 'deskmod', 'evidence', 
@@ -255,9 +285,7 @@ class AOProtocol(asyncio.Protocol):
 		CHECK#%
 		"""
 		self.client.send_command('CHECK')
-		self.ping_timeout.cancel()
-		self.ping_timeout = asyncio.get_event_loop().call_later(
-			self.server.config['timeout'], self.client.disconnect)
+		self.ping_timeout.reschedule(self.server.config['timeout'])
 
 	def net_cmd_askchaa(self, _):
 		"""Ask for the counts of characters/evidence/music
@@ -394,89 +422,22 @@ class AOProtocol(asyncio.Protocol):
 		statement = None
 
 		target_area = []
-		showname = ""
-		charid_pair = -1
-		offset_pair = ""
-		nonint_pre = 0
-		looping_sfx = 0
-		screenshake = 0
-		frame_screenshake = ""
-		frame_realization = ""
-		frame_sfx = ""
-		additive = 0
-		effect = ""
 		pair_order = 0
-		if self.validate_net_cmd(args, self.ArgType.STR, # msg_type
-								 self.ArgType.STR_OR_EMPTY, self.ArgType.STR, # pre, folder
-								 self.ArgType.STR, self.ArgType.STR, # anim, text
-								 self.ArgType.STR, self.ArgType.STR, # pos, sfx
-								 self.ArgType.INT, self.ArgType.INT, # anim_type, cid
-								 self.ArgType.INT, self.ArgType.INT_OR_STR, # sfx_delay, button
-								 self.ArgType.INT, self.ArgType.INT, # evidence, flip
-								 self.ArgType.INT, self.ArgType.INT): # ding, color
-			# Pre-2.6 validation monstrosity.
-			msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color = args
-		elif self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.STR_OR_EMPTY, self.ArgType.STR,
-								   self.ArgType.STR,
-								   self.ArgType.STR, self.ArgType.STR, self.ArgType.STR, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT_OR_STR, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT, self.ArgType.STR_OR_EMPTY):
-			# 1.3.0 validation monstrosity.
-			msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname = args
-			if len(showname) > 0 and not self.client.area.showname_changes_allowed:
-				self.client.send_host_message("Showname changes are forbidden in this area!")
-				return
-		elif self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.STR_OR_EMPTY, self.ArgType.STR,
-								   self.ArgType.STR,
-								   self.ArgType.STR, self.ArgType.STR, self.ArgType.STR, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT_OR_STR, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT, self.ArgType.STR_OR_EMPTY,
-								   self.ArgType.INT, self.ArgType.INT):
-			# 1.3.5 validation monstrosity.
-			msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair = args
-			if len(showname) > 0 and not self.client.area.showname_changes_allowed:
-				self.client.send_host_message("Showname changes are forbidden in this area!")
-				return
-		elif self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.STR_OR_EMPTY, self.ArgType.STR,
-								   self.ArgType.STR,
-								   self.ArgType.STR, self.ArgType.STR, self.ArgType.STR, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT_OR_STR, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT, self.ArgType.STR_OR_EMPTY,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT):
-			# 1.4.0 validation monstrosity.
-			msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair, nonint_pre = args
-			if len(showname) > 0 and not self.client.area.showname_changes_allowed:
-				self.client.send_host_message("Showname changes are forbidden in this area!")
-				return
-		elif self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.STR_OR_EMPTY, self.ArgType.STR,
-								   self.ArgType.STR,
-								   self.ArgType.STR, self.ArgType.STR, self.ArgType.STR, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT, self.ArgType.INT,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT, self.ArgType.STR_OR_EMPTY,
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT, self.ArgType.STR,
-								   self.ArgType.INT, self.ArgType.STR, self.ArgType.STR, self.ArgType.STR):
-			# 2.7.0 validation monstrosity
-			msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair, nonint_pre, looping_sfx, screenshake, frame_screenshake, frame_realization, frame_sfx = args
-			if len(showname) > 0 and not self.client.area.showname_changes_allowed:
-				self.client.send_host_message("Showname changes are forbidden in this area!")
-				return
-		elif self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.STR_OR_EMPTY, self.ArgType.STR, #msg_type, pre, folder
-								   self.ArgType.STR, #anim
-								   self.ArgType.STR, self.ArgType.STR, self.ArgType.STR, self.ArgType.INT, #text, pos, sfx, anim_type
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT_OR_STR, self.ArgType.INT, #cid, sfx_delay, button, evidence
-								   self.ArgType.INT, self.ArgType.INT, self.ArgType.INT, self.ArgType.STR_OR_EMPTY, #flip, ding, color, showname
-								   self.ArgType.STR, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR, #charid_pair, offset_pair
-								   self.ArgType.INT, self.ArgType.STR, self.ArgType.STR, self.ArgType.STR,
-								   self.ArgType.INT, self.ArgType.STR):
-			msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair, nonint_pre, looping_sfx, screenshake, frame_screenshake, frame_realization, frame_sfx, additive, effect = args
+		ms = self.parse_net_cmd(schema.MS, args)
+		if ms is None:
+			return
+		msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair, nonint_pre, looping_sfx, screenshake, frame_screenshake, frame_realization, frame_sfx, additive, effect = ms
+		if isinstance(charid_pair, str):
+			# 2.8 sends <cid>^<order>
 			pair_args = charid_pair.split("^")
-			charid_pair = int(pair_args[0])
+			try:
+				charid_pair = int(pair_args[0])
+			except ValueError:
+				return
 			if (len(pair_args) > 1):
 				pair_order = pair_args[1]
-			if len(showname) > 0 and not self.client.area.showname_changes_allowed:
-				self.client.send_host_message("Showname changes are forbidden in this area!")
-				return
-		else:
+		if len(showname) > 0 and not self.client.area.showname_changes_allowed:
+			self.client.send_host_message("Showname changes are forbidden in this area!")
 			return
 		self.client.showname = showname
 		if self.client.area.is_iniswap(self.client, pre, anim,
@@ -498,8 +459,7 @@ class AOProtocol(asyncio.Protocol):
 					"Blankposting is forbidden in this area, and putting more spaces in does not make it not blankposting."
 				)
 				return
-			if len(re.sub(r'[{}\\`|(~~)]', '', text).replace(
-					' ', '')) < 3 and text != '<' and text != '>':
+			if self.server.text_pipeline.is_spammy(text) and text != '<' and text != '>':
 				self.client.send_ooc(
 					"While that is not a blankpost, it is still pretty spammy. Try forming sentences."
 				)
@@ -584,22 +544,19 @@ class AOProtocol(asyncio.Protocol):
 			if pos not in self.client.area.poslock:
 				pos = self.client.area.poslock[0]
 				self.client.send_ooc(f'Your pos isn\'t in /poslock, falling back on {pos}. Please switch to a pos in /poslock!')
-		msg = self.dezalgo(text)[:256]
-		if self.client.shaken:
-			msg = self.client.shake_message(msg)
-		if self.client.gimp:  # If you're gimped, gimp message.
-			msg = self.client.gimp_message(msg)
-		if self.client.disemvowel:
-			msg = self.client.disemvowel_message(msg)
+		msg = self.server.text_pipeline.process(text, limit=256,
+			shaken=self.client.shaken,
+			gimp=self.server.gimp_list if self.client.gimp else None,
+			disemvowel=self.client.disemvowel)
 		if evidence:
 			if self.client.area.evi_list.evidences[
 					self.client.evi_list[evidence] - 1].pos != 'all':
 				self.client.area.evi_list.evidences[
 					self.client.evi_list[evidence] - 1].pos = 'all'
 				self.client.area.broadcast_evidence_list()
-		if msg.lstrip().startswith('(('):
-			msg = msg.lstrip()
-			msg = msg.replace('((', '')
+		stripped = msg.lstrip()
+		if stripped.startswith('(('):
+			msg = stripped.replace('((', '')
 			msg = msg.replace('))', '')
 			name = self.client.name
 			if name == '':
@@ -840,7 +797,8 @@ class AOProtocol(asyncio.Protocol):
 		if not self.client.permission:
 			self.client.send_ooc('You need permission to use a web client, please ask staff.')
 			return
-		if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.STR):
+		ct = self.parse_net_cmd(schema.CT, args)
+		if ct is None:
 			return
 		if self.client.name != args[0] and self.client.fake_name != args[0]:
 			if self.client.is_valid_name(args[0]):
@@ -848,21 +806,9 @@ class AOProtocol(asyncio.Protocol):
 				self.client.fake_name = args[0]
 			else:
 				self.client.fake_name = args[0]
-		if self.client.name == '':
-			self.client.send_ooc(
-				'You must insert a name with at least one letter')
-			return
-		if len(self.client.name) > 30:
-			self.client.send_ooc(
-				'Your OOC name is too long! Limit it to 30 characters.')
-			return
-		for c in self.client.name:
-			if unicodedata.category(c) == 'Cf':
-				self.client.send_ooc(
-					'You cannot use format characters in your name!')
-				return
-		if self.client.name.startswith(self.server.config['hostname']) or self.client.name.startswith('<dollar>G') or self.client.name.startswith('<dollar>M'):
-			self.client.send_ooc('That name is reserved!')
+		name_error = self.client.name_error
+		if name_error is not None:
+			self.client.send_ooc(name_error)
 			return
 		if args[1].startswith(' /'):
 			self.client.send_ooc(
@@ -904,11 +850,8 @@ class AOProtocol(asyncio.Protocol):
 				self.client.send_ooc('An internal error occurred. Please check the server log.')
 				logger.exception('Exception while running a command')
 		else:
-			args[1] = self.dezalgo(args[1])
-			if self.client.shaken:
-				args[1] = self.client.shake_message(args[1])
-			if self.client.disemvowel:
-				args[1] = self.client.disemvowel_message(args[1])
+			args[1] = self.server.text_pipeline.process(args[1],
+				shaken=self.client.shaken, disemvowel=self.client.disemvowel)
 			self.client.ooc_delay = (time.perf_counter() + self.server.config['ooc_delay'])
 			self.client.area.send_command('CT', self.client.name, args[1])
 			self.client.area.send_owner_command('CT', '[' + self.client.area.abbreviation + ']' + self.client.name, args[1])
@@ -955,12 +898,10 @@ class AOProtocol(asyncio.Protocol):
 					if not self.client.area.allowmusic and self.client not in self.client.area.owners:
 						self.client.send_ooc('The CM has disallowed music changes, ask them to change the music.')
 						return
-					if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT):
-						if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR_OR_EMPTY):
-							if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR_OR_EMPTY, self.ArgType.INT):
-								if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR_OR_EMPTY, self.ArgType.INT, self.ArgType.INT):
-									return
-					if args[1] != self.client.char_id:
+					mc = self.parse_net_cmd(schema.MC, args)
+					if mc is None:
+						return
+					if mc.cid != self.client.char_id:
 						return
 					if self.client.change_music_cd():
 						self.client.send_ooc(
@@ -968,10 +909,10 @@ class AOProtocol(asyncio.Protocol):
 							.format(int(self.client.change_music_cd())))
 						return
 					try:
-						if args[0] == "~stop.mp3":
-							name, length, mod, custom = args[0], 0, -1, False
+						if mc.name == "~stop.mp3":
+							name, length, mod, custom = mc.name, 0, -1, False
 						else:
-							name, length, mod, custom = self.server.get_song_data(args[0], self.client.area)
+							name, length, mod, custom = self.server.get_song_data(mc.name, self.client.area)
 						if not mod == -1:
 							if not self.client.is_mod:
 								self.client.send_host_message("This song is reserved for moderators.")
@@ -980,7 +921,7 @@ class AOProtocol(asyncio.Protocol):
 						if self.client.area.jukebox:
 							showname = ''
 							if len(args) > 2:
-								showname = args[2]
+								showname = mc.showname
 								if len(
 										showname
 								) > 0 and not self.client.area.showname_changes_allowed:
@@ -992,7 +933,7 @@ class AOProtocol(asyncio.Protocol):
 							database.log_room('jukebox.vote', self.client, self.client.area, message=name)
 						else:
 							if len(args) > 2:
-								showname = args[2]
+								showname = mc.showname
 								if len(
 										showname
 								) > 0 and not self.client.area.showname_changes_allowed:
@@ -1006,7 +947,7 @@ class AOProtocol(asyncio.Protocol):
 								name = 'custom/'
 								name += nname
 							if len(args) > 3:
-								effects = int(args[3])
+								effects = mc.effects
 								self.client.area.play_music_shownamed(
 									name, self.client.char_id, showname, length, effects)
 								self.client.area.add_music_playing_shownamed(
@@ -1157,10 +1098,11 @@ class AOProtocol(asyncio.Protocol):
 				"You are not on the area's invite list, and thus, you cannot change the Confidence bars!"
 			)
 			return
-		if not self.validate_net_cmd(args, self.ArgType.INT, self.ArgType.INT):
+		hp = self.parse_net_cmd(schema.HP, args)
+		if hp is None:
 			return
 		try:
-			self.client.area.change_hp(args[0], args[1])
+			self.client.area.change_hp(hp.bar, hp.value)
 			self.client.area.add_to_judgelog(self.client,
 											 'changed the penalties')
 			database.log_room('hp', self.client, self.client.area)
@@ -1177,11 +1119,11 @@ class AOProtocol(asyncio.Protocol):
 		"""
 		if not self.client.is_checked:
 			return
-		elif len(args) < 3:
+		pe = self.parse_net_cmd(schema.PE, args, needs_auth=False)
+		if pe is None:
 			return
-		# evi = Evidence(args[0], args[1], args[2], self.client.pos)
-		self.client.area.evi_list.add_evidence(self.client, args[0], args[1],
-											   args[2], 'all')
+		self.client.area.evi_list.add_evidence(self.client, pe.name,
+											   pe.description, pe.image, 'all')
 		database.log_room('evidence.add', self.client, self.client.area)
 		self.client.area.broadcast_evidence_list()
 
@@ -1193,8 +1135,11 @@ class AOProtocol(asyncio.Protocol):
 		"""
 		if not self.client.is_checked:
 			return
+		de = self.parse_net_cmd(schema.DE, args, needs_auth=False)
+		if de is None:
+			return
 		self.client.area.evi_list.del_evidence(
-			self.client, self.client.evi_list[int(args[0])])
+			self.client, self.client.evi_list[de.id])
 		database.log_room('evidence.del', self.client, self.client.area)
 		self.client.area.broadcast_evidence_list()
 
@@ -1206,13 +1151,14 @@ class AOProtocol(asyncio.Protocol):
 		"""
 		if not self.client.is_checked:
 			return
-		elif len(args) < 4:
+		ee = self.parse_net_cmd(schema.EE, args, needs_auth=False)
+		if ee is None:
 			return
 
-		evi = (args[1], args[2], args[3], 'all')
+		evi = (ee.name, ee.description, ee.image, 'all')
 
 		self.client.area.evi_list.edit_evidence(
-			self.client, self.client.evi_list[int(args[0])], evi)
+			self.client, self.client.evi_list[ee.id], evi)
 		database.log_room('evidence.edit', self.client, self.client.area)
 		self.client.area.broadcast_evidence_list()
 
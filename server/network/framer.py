@@ -0,0 +1,89 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class Framer:
+	"""
+	Splits a stream of bytes into `#%`-terminated AO messages.
+
+	Received data is appended to a single buffer. Each scan resumes
+	where the previous one stopped, and consumed frames are only cut
+	from the buffer once every complete frame has been read.
+	"""
+	terminator = b'#%'
+
+	def __init__(self, limit=8192):
+		"""
+		:param limit: maximum size of an incomplete message, in bytes
+		"""
+		self.buffer = bytearray()
+		self.offset = 0
+		self.limit = limit
+
+	def __len__(self):
+		"""Get the number of buffered bytes not yet framed."""
+		return len(self.buffer)
+
+	@property
+	def overflowed(self):
+		"""Whether the incomplete message exceeds the size limit."""
+		return len(self.buffer) > self.limit
+
+	def clear(self):
+		"""Drop any buffered data."""
+		self.buffer.clear()
+		self.offset = 0
+
+	def feed(self, data):
+		"""
+		Append received data to the buffer.
+		:param data: bytes received
+		"""
+		self.buffer += data.replace(b'\0', b'')
+
+	def frames(self):
+		"""
+		Yield each complete frame in the buffer, without its terminator.
+		A frame is a memoryview into the buffer and is only valid until
+		the next frame is requested.
+		"""
+		buf = self.buffer
+		start = 0
+		end = buf.find(self.terminator, self.offset)
+		if end == -1:
+			self.offset = max(len(buf) - len(self.terminator) + 1, 0)
+			return
+		try:
+			with memoryview(buf) as view:
+				while end != -1:
+					frame = view[start:end]
+					start = end + len(self.terminator)
+					try:
+						yield frame
+					finally:
+						frame.release()
+					end = buf.find(self.terminator, start)
+		finally:
+			# Frames handed out count as consumed, even if the caller
+			# stopped early
+			del buf[:start]
+			if end == -1:
+				self.offset = max(len(buf) - len(self.terminator) + 1, 0)
+			else:
+				self.offset = 0
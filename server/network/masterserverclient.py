@@ -33,13 +33,11 @@ class MasterServerClient:
         self.writer = None
 
     async def connect(self):
-        loop = asyncio.get_event_loop()
         while True:
             try:
                 self.reader, self.writer = await asyncio.open_connection(
                     self.server.config['masterserver_ip'],
-                    self.server.config['masterserver_port'],
-                    loop=loop)
+                    self.server.config['masterserver_port'])
                 await self.handle_connection()
             except (ConnectionRefusedError, TimeoutError,
                     ConnectionResetError, asyncio.IncompleteReadError):
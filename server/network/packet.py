@@ -0,0 +1,70 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+def encode_command(command, *args):
+	"""
+	Compose an AO-compatible message, with arguments delimited by `#`
+	and ending with `#%`.
+	:param command: command name
+	:param *args: list of arguments
+	:returns: UTF-8 encoded message
+	"""
+	if args:
+		return f'{command}#{"#".join([str(x) for x in args])}#%'.encode('utf-8')
+	return f'{command}#%'.encode('utf-8')
+
+
+class Packet:
+	"""
+	An outgoing command that is serialized at most once, no matter how
+	many clients it is broadcast to.
+	"""
+	__slots__ = ('command', 'args', '_data', '_variants')
+
+	def __init__(self, command, *args):
+		self.command = command
+		self.args = args
+		self._data = None
+		self._variants = None
+
+	@property
+	def data(self):
+		"""Get the encoded message, encoding it on first use."""
+		if self._data is None:
+			self._data = encode_command(self.command, *self.args)
+		return self._data
+
+	def variant(self, index, value):
+		"""
+		Get the encoded message with a single argument replaced.
+		Variants are cached, so recipients that need the same
+		replacement share the same bytes.
+		:param index: index of the argument to replace
+		:param value: replacement value
+		"""
+		if self._variants is None:
+			self._variants = {}
+		key = (index, value)
+		data = self._variants.get(key)
+		if data is None:
+			args = list(self.args)
+			args[index] = value
+			data = self._variants[key] = encode_command(self.command, *args)
+		return data
@@ -0,0 +1,220 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+def STR(arg):
+	"""A non-empty string."""
+	if len(arg) == 0:
+		raise ValueError('empty argument')
+	return arg
+
+
+def STR_OR_EMPTY(arg):
+	"""Any string."""
+	return arg
+
+
+def INT(arg):
+	"""An integer."""
+	return int(arg)
+
+
+# Kept as a string; the handler decides how to interpret it.
+INT_OR_STR = STR
+
+
+class Record:
+	"""Base class of parsed packets. Fields are listed in __slots__."""
+	__slots__ = ()
+
+	def __iter__(self):
+		for field in self.__slots__:
+			yield getattr(self, field)
+
+	def __repr__(self):
+		fields = ', '.join(f'{field}={getattr(self, field)!r}'
+			for field in self.__slots__)
+		return f'{type(self).__name__}({fields})'
+
+
+class Variant:
+	"""One version of a network command, parsing a fixed argument count."""
+
+	def __init__(self, name, fields, missing, record):
+		self.name = name
+		self.fields = fields
+		self.missing = missing
+		self.record = record
+		self.size = len(fields)
+		# Number of packets parsed with this variant
+		self.parsed = 0
+
+	def parse(self, args):
+		"""
+		Parse the arguments of a command.
+		:param args: list of string arguments, exactly `size` long
+		:returns: record, or None if an argument has the wrong type
+		"""
+		record = self.record()
+		try:
+			for (field, convert), arg in zip(self.fields, args):
+				setattr(record, field, convert(arg))
+		except ValueError:
+			return None
+		for field, value in self.missing:
+			setattr(record, field, value)
+		self.parsed += 1
+		return record
+
+
+class PacketSchema:
+	"""
+	Parses the arguments of a network command into a slotted record.
+
+	A command may come in several variants, one per client version,
+	told apart by their argument count. Parsing looks up the variant by
+	argument count and converts every argument in a single pass. Fields
+	missing from the variant get their default value.
+	"""
+
+	def __init__(self, command, variants, defaults=None, extra=False):
+		"""
+		:param command: command name
+		:param variants: list of (name, fields) variants, where fields is
+		a list of (field, type) pairs, and type is one of STR,
+		STR_OR_EMPTY, INT or INT_OR_STR
+		:param defaults: default values of fields missing from a variant
+		:param extra: whether to ignore arguments past the longest variant
+		"""
+		defaults = defaults or {}
+		fields = []
+		for _, variant in variants:
+			for field, _ in variant:
+				if field not in fields:
+					fields.append(field)
+		self.command = command
+		self.record = type(f'{command}Record', (Record,),
+			{'__slots__': tuple(fields)})
+		self.variants = {}
+		self.by_name = {}
+		for name, variant in variants:
+			present = {field for field, _ in variant}
+			missing = tuple((field, defaults.get(field))
+				for field in fields if field not in present)
+			self.variants[len(variant)] = self.by_name[name] = \
+				Variant(name, tuple(variant), missing, self.record)
+		self.max_args = max(self.variants)
+		self.extra = extra
+
+	@property
+	def stats(self):
+		"""Get the number of packets parsed with each variant."""
+		return {name: variant.parsed
+			for name, variant in self.by_name.items()}
+
+	def detect(self, args):
+		"""
+		Find the variant matching the arguments of a command.
+		:param args: list of string arguments
+		:returns: variant, or None if no variant takes that many arguments
+		"""
+		if self.extra and len(args) > self.max_args:
+			return self.variants[self.max_args]
+		return self.variants.get(len(args))
+
+	def parse(self, args, variant=None):
+		"""
+		Parse the arguments of a command.
+		:param args: list of string arguments
+		:param variant: variant expected to match, such as the one the
+		client used last; detected again if it does not (Default value = None)
+		:returns: record, or None if the arguments match no variant
+		"""
+		if variant is None or variant.size != len(args):
+			variant = self.detect(args)
+			if variant is None:
+				return None
+		if len(args) > variant.size:
+			args = args[:variant.size]
+		return variant.parse(args)
+
+
+_MS_BASE = [
+	('msg_type', STR), ('pre', STR_OR_EMPTY), ('folder', STR),
+	('anim', STR), ('text', STR), ('pos', STR), ('sfx', STR),
+	('anim_type', INT), ('cid', INT), ('sfx_delay', INT),
+	('button', INT_OR_STR), ('evidence', INT), ('flip', INT),
+	('ding', INT), ('color', INT)
+]
+
+MS = PacketSchema('MS', [
+	('pre-2.6', _MS_BASE),
+	('1.3.0', _MS_BASE + [('showname', STR_OR_EMPTY)]),
+	('1.3.5', _MS_BASE + [('showname', STR_OR_EMPTY), ('charid_pair', INT),
+		('offset_pair', INT)]),
+	('1.4.0', _MS_BASE + [('showname', STR_OR_EMPTY), ('charid_pair', INT),
+		('offset_pair', INT), ('nonint_pre', INT)]),
+	('2.7.0', _MS_BASE[:10] + [('button', INT)] + _MS_BASE[11:] + [
+		('showname', STR_OR_EMPTY), ('charid_pair', INT),
+		('offset_pair', INT), ('nonint_pre', INT), ('looping_sfx', STR),
+		('screenshake', INT), ('frame_screenshake', STR),
+		('frame_realization', STR), ('frame_sfx', STR)]),
+	# charid_pair is <cid>^<order> since 2.8
+	('2.8', _MS_BASE + [('showname', STR_OR_EMPTY), ('charid_pair', STR),
+		('offset_pair', STR), ('nonint_pre', INT), ('looping_sfx', STR),
+		('screenshake', INT), ('frame_screenshake', STR),
+		('frame_realization', STR), ('frame_sfx', STR),
+		('additive', INT), ('effect', STR)])
+], defaults={
+	'showname': '', 'charid_pair': -1, 'offset_pair': '',
+	'nonint_pre': 0, 'looping_sfx': 0, 'screenshake': 0,
+	'frame_screenshake': '', 'frame_realization': '', 'frame_sfx': '',
+	'additive': 0, 'effect': ''
+})
+
+MC = PacketSchema('MC', [
+	('track', [('name', STR), ('cid', INT)]),
+	('showname', [('name', STR), ('cid', INT), ('showname', STR_OR_EMPTY)]),
+	('effects', [('name', STR), ('cid', INT), ('showname', STR_OR_EMPTY),
+		('effects', INT)]),
+	('channel', [('name', STR), ('cid', INT), ('showname', STR_OR_EMPTY),
+		('effects', INT), ('channel', INT)])
+], defaults={'showname': '', 'effects': 0, 'channel': 0})
+
+CT = PacketSchema('CT', [
+	('CT', [('name', STR), ('message', STR)])
+])
+
+HP = PacketSchema('HP', [
+	('HP', [('bar', INT), ('value', INT)])
+])
+
+PE = PacketSchema('PE', [
+	('PE', [('name', STR_OR_EMPTY), ('description', STR_OR_EMPTY),
+		('image', STR_OR_EMPTY)])
+], extra=True)
+
+DE = PacketSchema('DE', [
+	('DE', [('id', INT)])
+], extra=True)
+
+EE = PacketSchema('EE', [
+	('EE', [('id', INT), ('name', STR_OR_EMPTY), ('description', STR_OR_EMPTY),
+		('image', STR_OR_EMPTY)])
+], extra=True)
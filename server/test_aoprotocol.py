@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from server.network import schema
+from server.network.aoprotocol import AOProtocol
+
+
+def handshake(data):
+    sent = []
+    protocol = AOProtocol(SimpleNamespace(config={'asset_url': ''}))
+    protocol.client = SimpleNamespace(
+        ipid=0, send_command=lambda *args: sent.append(args))
+    protocol.data_received(data)
+    return protocol, sent
+
+
+def test_ao2_handshake_preselects_ic_format():
+    protocol, sent = handshake(b'ID#AO2#2.9.1#%')
+    assert protocol.variants['MS'] is schema.MS.by_name['2.8']
+    assert sent[0][0] == 'FL'
+    protocol, _ = handshake(b'ID#AO2#2.7.2#%')
+    assert protocol.variants['MS'] is schema.MS.by_name['2.7.0']
+
+
+def test_client_version():
+    assert AOProtocol.client_version(['AO2', '2.10.1']) == (2, 10)
+    assert AOProtocol.client_version(['1', 'AO2', '2.8.5']) == (2, 8)
+    assert AOProtocol.client_version(['AO2']) is None
+    assert AOProtocol.client_version(['webAO', 'web']) is None
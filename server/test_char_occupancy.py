@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from server.area_manager import AreaManager
+from server.exceptions import AreaError
+
+
+def make_area(chars=4):
+    server = SimpleNamespace(char_list=[f'char{i}' for i in range(chars)])
+    return AreaManager.Area(0, server, 'Courtroom', 'gs4')
+
+
+def test_chars_taken_and_freed():
+    area = make_area()
+    area.occupy_char(1, 1)
+    area.occupy_char(1, 1)
+    area.occupy_char(-1, 1)
+    assert not area.is_char_available(1)
+    assert area.is_char_available(2)
+    assert area.get_chars_check() == [0, -1, 0, 0]
+    area.occupy_char(1, -1)
+    assert not area.is_char_available(1)
+    area.move_char(1, 3)
+    assert area.is_char_available(1)
+    assert area.get_chars_check() == [0, 0, 0, -1]
+    assert area.chars_check_packet.data == b'CharsCheck#0#0#0#-1#%'
+
+
+def test_chars_check_cached_until_changed():
+    area = make_area()
+    area.occupy_char(0, 1)
+    packet = area.chars_check_packet
+    area.occupy_char(0, 1)
+    area.occupy_char(0, -1)
+    assert area.chars_check_packet is packet
+    area.occupy_char(2, 1)
+    assert area.chars_check_packet is not packet
+    # Resized when the character list is reloaded
+    area.server.char_list.append('char4')
+    assert area.get_chars_check() == [-1, 0, -1, 0, 0]
+
+
+def test_random_available_char():
+    area = make_area(3)
+    area.occupy_char(0, 1)
+    area.occupy_char(2, 1)
+    assert area.get_rand_avail_char_id() == 1
+    area.occupy_char(1, 1)
+    with pytest.raises(AreaError):
+        area.get_rand_avail_char_id()
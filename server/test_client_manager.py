@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pytest
+
+from server import client_manager
+from server.client_manager import ClientManager
+
+
+class FakeTransport:
+    def __init__(self, ip):
+        self.ip = ip
+
+    def get_extra_info(self, name):
+        return (self.ip, 0)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    ipids = {}
+    monkeypatch.setattr(client_manager, 'database', SimpleNamespace(
+        ipid=lambda ip: ipids.setdefault(ip, len(ipids) + 1)))
+    area = SimpleNamespace(jukebox=False, clients=set(),
+                           update_visible=lambda client: None)
+    server = SimpleNamespace(
+        config={'playerlimit': 10, 'music_change_floodguard':
+                {'times_per_interval': 1, 'interval_length': 0,
+                 'mute_length': 0},
+                'wtce_floodguard': {'times_per_interval': 1,
+                                    'interval_length': 0,
+                                    'mute_length': 0}},
+        area_manager=SimpleNamespace(default_area=lambda: area, areas=[]),
+        char_list=[])
+    server.is_valid_char_id = lambda char_id: \
+        len(server.char_list) > char_id >= 0
+    server.client_manager = ClientManager(server)
+    return server.client_manager
+
+
+def test_remove_client_twice(manager):
+    first = manager.new_client(FakeTransport('10.0.0.1'))
+    second = manager.new_client(FakeTransport('10.0.0.1'))
+    manager.remove_client(first)
+    third = manager.new_client(FakeTransport('10.0.0.2'))
+    assert third.id == first.id
+    # Removed again once its connection is lost
+    manager.remove_client(first)
+    assert manager.allocate_id() not in (second.id, third.id)
+    assert manager.get_multiclients(second.ipid) == {second}
+    assert manager.clients_by_id[third.id] is third
+
+
+def test_name_released_once_per_client(manager):
+    first = manager.new_client(FakeTransport('10.0.0.1'))
+    second = manager.new_client(FakeTransport('10.0.0.1'))
+    other = manager.new_client(FakeTransport('10.0.0.2'))
+    first.name = second.name = 'Phoenix'
+    manager.release_name(first, 'Phoenix')
+    manager.release_name(first, 'Phoenix')
+    assert not other.is_valid_name('Phoenix')
+    assert second.is_valid_name('Phoenix')
+    second.name = 'Maya'
+    assert other.is_valid_name('Phoenix')
+
+
+def test_character_removed_from_list(manager):
+    manager.server.char_list = ['Phoenix', 'Maya', 'Edgeworth']
+    client = manager.new_client(FakeTransport('10.0.0.1'))
+    spectator = manager.new_client(FakeTransport('10.0.0.2'))
+    client.char_id = 2
+    selected = []
+    client.char_select = lambda: selected.append(client)
+    spectator.char_select = lambda: selected.append(spectator)
+
+    manager.server.char_list = ['Phoenix', 'Maya']
+    assert client.char_name is None
+    manager.reindex_char_names()
+    assert selected == [client]
+    client.char_id = 1
+    assert manager.char_names.match('maya') == [client]
+    client.char_id = 5
+    manager.remove_client(client)
+    assert manager.char_names.match('maya') == []
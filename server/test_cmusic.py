@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+
+from server.area_manager import AreaManager
+
+
+def test_shared_custom_list_recompiled_in_every_area():
+    server = SimpleNamespace(char_list=[])
+    hub = AreaManager.Area(0, server, 'Hub', 'gs4', is_hub=True)
+    subs = [AreaManager.Area(i, server, f'Area {i}', 'gs4') for i in (1, 2)]
+    for sub in subs:
+        sub.sub = True
+        sub.hub = hub
+        sub.cmusic_list = hub.cmusic_list
+        hub.subareas.append(sub)
+
+    mlist = subs[0].cmusic_list
+    mlist.append({'category': 'CUSTOM', 'songs': [
+        {'name': 'Trial.mp3', 'length': 90}]})
+    subs[0].update_cmusic_catalogs()
+    for area in [hub] + subs:
+        assert area.cmusic_catalog.get('Trial.mp3') is not None
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import types
+
+import pytest
+
+pytest.importorskip('arrow')
+
+from server.database import Database
+from server.exceptions import ServerError
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    (tmp_path / 'storage').mkdir()
+    (tmp_path / 'migrations').symlink_to(os.path.abspath(MIGRATIONS))
+    monkeypatch.chdir(tmp_path)
+    db = Database()
+    yield db
+    db.writer.stop()
+    db.db.close()
+
+
+def moderator(db):
+    return types.SimpleNamespace(name='mod', ipid=db.ipid('10.0.0.1'))
+
+
+def test_ban_found_by_ipid_and_hdid(db):
+    ipid = db.ipid('10.0.0.2')
+    db.add_hdid(ipid, 'hdid-a')
+    ban_id = db.ban(ipid, 'spam', banned_by=moderator(db))
+    db.ban('hdid-a', 'spam', ban_type='hdid', ban_id=ban_id)
+
+    assert db.find_ban(ipid, 'other').ban_id == ban_id
+    assert db.find_ban(None, 'hdid-a').ban_id == ban_id
+    assert db.find_ban(ban_id=str(ban_id)).reason == 'spam'
+    assert db.find_ban(db.ipid('10.0.0.3'), 'hdid-b') is None
+
+
+def test_unban_clears_index_and_database(db):
+    ipid = db.ipid('10.0.0.2')
+    ban_id = db.ban(ipid, 'spam', banned_by=moderator(db))
+    assert db.unban(str(ban_id))
+    assert not db.unban(ban_id)
+    assert not db.unban('not a ban')
+    assert db.find_ban(ipid) is None
+
+    db.load_bans()
+    assert db.find_ban(ipid) is None
+    # The IPID can be banned again
+    assert db.ban(ipid, 'again', banned_by=moderator(db)) is not None
+
+
+def test_bans_loaded_at_startup(db):
+    ipid = db.ipid('10.0.0.2')
+    db.add_hdid(ipid, 'hdid-a')
+    ban_id = db.ban('hdid-a', 'alt', ban_type='hdid', banned_by=moderator(db))
+    db.writer.flush()
+
+    reloaded = Database()
+    try:
+        assert reloaded.find_ban(None, 'hdid-a').ban_id == ban_id
+        assert ('hdid-a', ipid) in reloaded.hdids
+        assert reloaded.find_ban(ban_id=ban_id).unban_date is None
+    finally:
+        reloaded.writer.stop()
+        reloaded.db.close()
+
+
+def test_ipids_allocated_in_memory(db):
+    first = db.ipid('10.0.0.5')
+    second = db.ipid('10.0.0.6')
+    assert second == first + 1
+    assert db.ipid('10.0.0.5') == first
+
+    db.writer.flush()
+    with db.db as conn:
+        rows = dict(conn.execute('SELECT ip_address, ipid FROM ipids').fetchall())
+    assert rows['10.0.0.5'] == first
+    assert rows['10.0.0.6'] == second
+
+    db.load_ipids()
+    assert db.ipid('10.0.0.7') == second + 1
+
+
+def test_failed_batch_not_written_twice(db):
+    insert = ('INSERT INTO misc_events(ipid, target_ipid, event_data,'
+              ' event_subtype) VALUES (?, ?, ?, ?)')
+    conn = sqlite3.connect(db.writer.path)
+    conn.execute('PRAGMA foreign_keys = ON')
+    try:
+        db.writer.write(conn, [
+            (insert, (None, None, '1'), ('misc', 'test.batch')),
+            # A new subtype in the middle of the batch
+            (insert, (None, None, '2'), ('misc', 'test.other')),
+            ('INSERT INTO missing_table VALUES (?)', (1,), None),
+        ])
+        rows = conn.execute(
+            'SELECT event_data FROM misc_events JOIN misc_event_types'
+            ' ON event_subtype = type_id WHERE type_name LIKE ?',
+            ('test.%',)).fetchall()
+    finally:
+        conn.close()
+    assert sorted(rows) == [('1',), ('2',)]
+    assert db.writer.failed == 1
+
+
+def test_ban_does_not_wait_for_writer(db):
+    # Leave the IPID rows queued
+    db.writer.stop()
+    ipid = db.ipid('10.0.0.8')
+    ban_id = db.ban(ipid, 'spam', banned_by=moderator(db))
+    assert db.find_ban(ipid).ban_id == ban_id
+    with db.db as conn:
+        assert conn.execute('SELECT 1 FROM ip_bans WHERE ipid = ?',
+                            (ipid,)).fetchone() is not None
+
+
+def test_failed_ban_not_indexed(db):
+    with pytest.raises(ServerError):
+        db.ban(999999, 'spam', banned_by=moderator(db))
+    assert len(db.bans) == 0
+    with pytest.raises(ServerError):
+        db.ban('hdid-a', 'spam', ban_type='hdid', ban_id=12345)
+    assert db.find_ban(None, 'hdid-a') is None
+
+
+def test_warn_does_not_wait_for_writer(db):
+    db.writer.stop()
+    target = types.SimpleNamespace(ipid=db.ipid('10.0.0.9'))
+    warn_id = db.warn(target, 'spam', warned_by=moderator(db))
+    with db.db as conn:
+        row = conn.execute('SELECT ipid FROM warns WHERE warn_id = ?',
+                           (warn_id,)).fetchone()
+    assert row['ipid'] == target.ipid
+
+
+def test_reban_straight_after_unban(db):
+    ipid = db.ipid('10.0.0.2')
+    db.add_hdid(ipid, 'hdid-a')
+    ban_id = db.ban(ipid, 'spam', banned_by=moderator(db))
+    db.ban('hdid-a', 'spam', ban_type='hdid', ban_id=ban_id)
+    assert db.unban(ban_id)
+
+    ipid_ban = db.ban(ipid, 'again', banned_by=moderator(db))
+    hdid_ban = db.ban('hdid-a', 'again', ban_type='hdid',
+                      banned_by=moderator(db))
+    assert db.find_ban(ipid).ban_id == ipid_ban
+    assert db.find_ban(None, 'hdid-a').ban_id == hdid_ban
+    assert db.unban(ipid_ban)
+    assert db.find_ban(ipid) is None
+    assert db.find_ban(None, 'hdid-a').ban_id == hdid_ban
+    assert db.bans.targets == {hdid_ban: (set(), {'hdid-a'})}
@@ -1,7 +1,42 @@
-from server.fantacrypt import fanta_decrypt, fanta_encrypt
+import random
+
+from server.fantacrypt import fanta_decrypt, fanta_encrypt, CRYPT_CONST_1, CRYPT_CONST_2, CRYPT_KEY
+
+
+def reference_decrypt(data):
+    """The original per-byte decoder, kept to check the fast one against."""
+    data_bytes = [int(data[x:x + 2], 16) for x in range(0, len(data), 2)]
+    key = CRYPT_KEY
+    ret = ''
+    for byte in data_bytes:
+        val = byte ^ ((key & 0xffff) >> 8)
+        ret += chr(val)
+        key = ((byte + key) * CRYPT_CONST_1) + CRYPT_CONST_2
+    return ret
+
+
+def random_message(rng, length):
+    return ''.join(chr(rng.randrange(256)) for _ in range(length))
+
 
 def test_fanta_decrypt():
     assert fanta_decrypt("4D90") == "MS"
 
 def test_fanta_encrypt():
-    assert fanta_encrypt("MS") == "4D90"
\ No newline at end of file
+    assert fanta_encrypt("MS") == "4D90"
+
+def test_fanta_round_trip():
+    rng = random.Random(0)
+    for length in (0, 1, 2, 7, 64, 1000):
+        message = random_message(rng, length)
+        encrypted = fanta_encrypt(message)
+        assert len(encrypted) == 2 * length
+        assert fanta_decrypt(encrypted) == message
+        assert fanta_decrypt(encrypted.lower()) == message
+
+def test_fanta_decrypt_matches_reference():
+    rng = random.Random(1)
+    for length in (1, 3, 32, 500):
+        data = ''.join(rng.choice('0123456789ABCDEF') for _ in range(2 * length))
+        assert fanta_decrypt(data) == reference_decrypt(data)
+    assert fanta_decrypt('4D9') == reference_decrypt('4D9')
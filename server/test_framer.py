@@ -0,0 +1,46 @@
+from server.network.framer import Framer
+
+
+def frames(framer):
+    return [bytes(frame) for frame in framer.frames()]
+
+
+def test_framer_splits_messages():
+    framer = Framer()
+    framer.feed(b'HI#abc#%ID#1#2#%CH#')
+    assert frames(framer) == [b'HI#abc', b'ID#1#2']
+    assert bytes(framer.buffer) == b'CH#'
+
+
+def test_framer_joins_partial_messages():
+    framer = Framer()
+    received = []
+    for chunk in (b'MS#hel', b'lo#', b'%', b'CH#1#%'):
+        framer.feed(chunk)
+        received += frames(framer)
+    assert received == [b'MS#hello', b'CH#1']
+    assert len(framer) == 0
+
+
+def test_framer_strips_nul():
+    framer = Framer()
+    framer.feed(b'C\0H#\x001#%')
+    assert frames(framer) == [b'CH#1']
+
+
+def test_framer_stopped_early():
+    framer = Framer()
+    framer.feed(b'A#%B#%C#%')
+    for frame in framer.frames():
+        break
+    assert frames(framer) == [b'B', b'C']
+
+
+def test_framer_limit():
+    framer = Framer(limit=16)
+    framer.feed(b'A#%' + b'x' * 16)
+    assert frames(framer) == [b'A']
+    assert not framer.overflowed
+    framer.feed(b'x')
+    assert frames(framer) == []
+    assert framer.overflowed
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import types
+
+import pytest
+
+pytest.importorskip('geoip2')
+
+import geoip2.errors
+
+from server.geoip import ASNResolver, NO_ASN
+
+
+class FakeReader:
+    """Stands in for a GeoLite2 reader, counting the lookups it serves."""
+
+    def __init__(self, asns):
+        self.asns = asns
+        self.lookups = 0
+        self.threads = set()
+        self.closed = False
+
+    def asn(self, ip):
+        self.lookups += 1
+        self.threads.add(threading.current_thread().name)
+        if ip not in self.asns:
+            raise geoip2.errors.AddressNotFoundError(ip)
+        return types.SimpleNamespace(autonomous_system_number=self.asns[ip])
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def resolver():
+    resolver = ASNResolver('missing.mmdb', cache_size=2, ttl=60)
+    resolver.reader = FakeReader({'1.1.1.1': 13335, '8.8.8.8': 15169})
+    yield resolver
+    resolver.close()
+
+
+def test_no_database():
+    resolver = ASNResolver('missing.mmdb')
+    assert not resolver.load()
+    assert resolver.lookup('1.1.1.1') == NO_ASN
+    resolver.close()
+
+
+def test_lookup_cached(resolver):
+    assert resolver.lookup('1.1.1.1') == '13335'
+    assert resolver.lookup('1.1.1.1') == '13335'
+    assert resolver.lookup('9.9.9.9') == NO_ASN
+    assert resolver.reader.lookups == 2
+    assert resolver.stats['hits'] == 1
+    assert resolver.stats['misses'] == 2
+
+
+def test_lru_eviction_and_ttl(resolver):
+    resolver.lookup('1.1.1.1')
+    resolver.lookup('8.8.8.8')
+    resolver.lookup('1.1.1.1')
+    resolver.lookup('9.9.9.9')
+    assert list(resolver.cache) == ['1.1.1.1', '9.9.9.9']
+
+    resolver.ttl = -1
+    resolver.store('8.8.8.8', '15169')
+    assert resolver.get_cached('8.8.8.8') is None
+    assert resolver.stats['expired'] == 1
+
+
+def test_lookup_async_off_loop(resolver):
+    async def lookup():
+        return await asyncio.gather(resolver.lookup_async('8.8.8.8'),
+            resolver.lookup_async('1.1.1.1'))
+    assert asyncio.run(lookup()) == ['15169', '13335']
+    assert all(name.startswith('geoip') for name in resolver.reader.threads)
+    assert resolver.get_cached('8.8.8.8') == '15169'
+
+
+def test_swapped_reader_closed_after_lookups(resolver):
+    old = resolver.reader
+
+    async def swap():
+        pending = resolver.lookup_async('8.8.8.8')
+        task = asyncio.ensure_future(pending)
+        await asyncio.sleep(0)
+        resolver.reader = FakeReader({'8.8.8.8': 1})
+        resolver.cache.clear()
+        resolver.executor.submit(old.close)
+        return await task
+    assert asyncio.run(swap()) == '15169'
+    resolver.executor.submit(lambda: None).result()
+    assert old.closed
+    # Read from the old database, so not cached
+    assert resolver.get_cached('8.8.8.8') is None
+
+
+def test_miss_resolved_in_background_counted_once(resolver):
+    assert resolver.get_cached('8.8.8.8') is None
+    assert asyncio.run(resolver.resolve_async('8.8.8.8')) == '15169'
+    assert resolver.lookup('8.8.8.8') == '15169'
+    assert (resolver.stats['misses'], resolver.stats['hits']) == (1, 1)
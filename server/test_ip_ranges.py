@@ -0,0 +1,51 @@
+import random
+
+from server.ip_ranges import IPRangeBans
+
+
+def legacy_match(lines, address, asn):
+    """The linear scan new_client used to run."""
+    for line, entry in enumerate(lines):
+        if entry != '' and address.startswith(entry) or asn == entry:
+            return line
+    return None
+
+
+def test_prefix_asn_and_cidr():
+    bans = IPRangeBans([
+        '# comment',
+        '185.220.10',
+        'AS20473',
+        '192.0.2.0/24',
+        '2001:db8::/32',
+        '',
+        '185.220.',
+    ])
+    assert len(bans) == 5
+    assert bans.match('185.220.101.4') == 1
+    assert bans.match('185.220.2.4') == 6
+    assert bans.match('8.8.8.8', '20473') == 2
+    assert bans.match('192.0.2.77') == 3
+    assert bans.match('::ffff:192.0.2.77') == 3
+    assert bans.match('2001:db8::1') == 4
+    assert bans.match('192.0.3.1', 'Loopback') is None
+
+
+def test_first_line_wins():
+    bans = IPRangeBans(['10.0.0.0/8', '10.1', '10.1.2.0/24'])
+    assert bans.match('10.1.2.3') == 0
+    bans.compile(['10.1', '10.0.0.0/8'])
+    assert bans.match('10.1.2.3') == 0
+
+
+def test_matches_legacy_scan():
+    with open('config_sample/iprange_ban.txt', encoding='utf-8') as ipranges:
+        lines = ipranges.read().splitlines()
+    bans = IPRangeBans(lines)
+    rng = random.Random(0)
+    asns = [line for line in lines if line.isdigit()] + ['Loopback', '1']
+    for _ in range(5000):
+        address = '.'.join(str(rng.choice([rng.randrange(256), 185, 46, 94, 177]))
+            for _ in range(4))
+        asn = rng.choice(asns)
+        assert bans.match(address, asn) == legacy_match(lines, address, asn)
@@ -0,0 +1,26 @@
+from server.client_manager import ClientManager
+
+
+def test_match_prefixes_longest_first():
+    index = ClientManager.NameIndex()
+    index.add('a', 'Phoenix')
+    index.add('b', 'phoenix wright')
+    index.add('c', 'Maya')
+    index.add('d', '')
+    assert index.match('Phoenix Wright hello') == ['b', 'a']
+    assert index.match('phoenix') == ['a']
+    assert index.match('maya: hi') == ['c']
+    assert index.match('Edgeworth') == []
+
+
+def test_move_and_prune():
+    index = ClientManager.NameIndex()
+    index.add('a', 'Phoenix')
+    index.add('b', 'Phoenix')
+    index.move('a', 'Phoenix', 'Apollo')
+    assert index.match('phoenix') == ['b']
+    assert index.match('apollo') == ['a']
+    index.remove('b', 'Phoenix')
+    index.remove('a', 'Apollo')
+    index.remove('a', 'Unknown')
+    assert index.root == {}
@@ -0,0 +1,44 @@
+from server.network import schema
+
+MS_26 = ['chat', '-', 'Phoenix', 'normal', 'Hello', 'def', '1', '0', '3',
+         '0', '0', '0', '0', '0', '0', 'Nick', '5^1', '0&0', '0', '0', '0',
+         '-', '-', '-', '0', '||']
+
+
+def test_ms_current():
+    ms = schema.MS.parse(MS_26)
+    assert ms.text == 'Hello'
+    assert ms.cid == 3
+    assert ms.charid_pair == '5^1'
+    assert ms.additive == 0
+
+
+def test_ms_old_client_defaults():
+    ms = schema.MS.parse(MS_26[:15])
+    assert ms.color == 0
+    assert ms.showname == ''
+    assert ms.charid_pair == -1
+    assert len(list(ms)) == len(type(ms).__slots__)
+
+
+def test_ms_invalid():
+    assert schema.MS.parse(MS_26[:14]) is None
+    assert schema.MS.parse(MS_26[:8] + ['x'] + MS_26[9:15]) is None
+    assert schema.MS.parse(MS_26[:4] + [''] + MS_26[5:15]) is None
+
+
+def test_evidence_extra_args():
+    pe = schema.PE.parse(['Badge', 'Shiny', 'badge.png', 'extra'])
+    assert (pe.name, pe.description, pe.image) == ('Badge', 'Shiny', 'badge.png')
+    assert schema.PE.parse(['Badge', 'Shiny']) is None
+
+
+def test_variant_reused_and_counted():
+    variant = schema.MS.by_name['2.8']
+    before = variant.parsed
+    assert schema.MS.parse(MS_26, variant).cid == 3
+    # A cached variant that no longer fits is detected again
+    ms = schema.MS.parse(MS_26[:15], variant)
+    assert ms.showname == ''
+    assert variant.parsed == before + 1
+    assert schema.MS.stats['pre-2.6'] >= 1
@@ -0,0 +1,125 @@
+import pytest
+
+from server.timer_wheel import TimerWheel
+
+
+class ManualLoop:
+    """Stands in for an event loop whose clock only moves when told to."""
+
+    def __init__(self):
+        self.now = 0
+        self.scheduled = None
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback):
+        self.scheduled = Handle(when, callback)
+        return self.scheduled
+
+    def call_exception_handler(self, context):
+        raise context['exception']
+
+    def advance(self, seconds):
+        """Move the clock forward, running the callbacks that come due."""
+        target = self.now + seconds
+        while self.scheduled is not None and self.scheduled.when <= target:
+            handle, self.scheduled = self.scheduled, None
+            self.now = max(self.now, handle.when)
+            if not handle.cancelled:
+                handle.callback()
+        self.now = target
+
+
+class Handle:
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def loop():
+    return ManualLoop()
+
+
+@pytest.fixture
+def wheel(loop):
+    wheel = TimerWheel(resolution=1, slots=8)
+    wheel.start(loop)
+    yield wheel
+    wheel.stop()
+
+
+def test_timers_fire_in_batches(loop, wheel):
+    fired = []
+    for i in range(5):
+        wheel.call_later(2, fired.append, i)
+    wheel.call_later(5, fired.append, 'late')
+    loop.advance(1)
+    assert fired == []
+    loop.advance(1)
+    assert sorted(fired) == [0, 1, 2, 3, 4]
+    loop.advance(3)
+    assert fired[-1] == 'late'
+    assert wheel.fired == 6
+    assert len(wheel) == 0
+
+
+def test_timer_cancelled(loop, wheel):
+    fired = []
+    timer = wheel.call_later(2, fired.append, 'x')
+    timer.cancel()
+    loop.advance(5)
+    assert fired == []
+    assert len(wheel) == 0
+
+
+def test_timer_pushed_back(loop, wheel):
+    fired = []
+    timer = wheel.call_later(3, fired.append, 'x')
+    for _ in range(4):
+        loop.advance(2)
+        timer.reschedule(3)
+    assert fired == []
+    loop.advance(2)
+    assert fired == []
+    loop.advance(1)
+    assert fired == ['x']
+
+
+def test_timer_brought_forward_and_rearmed(loop, wheel):
+    fired = []
+    timer = wheel.call_later(100, fired.append, 'x')
+    timer.reschedule(1)
+    loop.advance(1)
+    assert fired == ['x']
+    timer.reschedule(1)
+    loop.advance(1)
+    assert fired == ['x', 'x']
+
+
+def test_timer_beyond_one_turn(loop, wheel):
+    # 8 slots of 1s make a 8s turn
+    fired = []
+    wheel.call_later(15, fired.append, 'x')
+    loop.advance(8)
+    loop.advance(6)
+    assert fired == []
+    loop.advance(1)
+    assert fired == ['x']
+
+
+def test_timer_rescheduled_by_callback(loop, wheel):
+    fired = []
+
+    def tick():
+        fired.append(loop.time())
+        if len(fired) < 3:
+            timer.reschedule(2)
+    timer = wheel.call_later(2, tick)
+    loop.advance(10)
+    assert fired == [2, 4, 6]
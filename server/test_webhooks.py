@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('arrow')
+
+from server import webhooks
+from server.webhooks import WebhookWorker
+
+
+class StubEndpoint(ThreadingHTTPServer):
+    """Local webhook endpoint that answers with a scripted list of codes."""
+
+    def __init__(self, codes):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.codes = list(codes)
+        self.payloads = []
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/webhook'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.payloads.append(json.loads(body))
+        code = self.server.codes.pop(0) if self.server.codes else 204
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class LogRecorder:
+    def __init__(self):
+        self.events = []
+
+    def log_misc(self, event, data=None):
+        self.events.append((event, data))
+
+
+@pytest.fixture
+def log(monkeypatch):
+    recorder = LogRecorder()
+    monkeypatch.setattr(webhooks, 'database', recorder)
+    return recorder
+
+
+def deliver(codes, payloads, **kwargs):
+    endpoint = StubEndpoint(codes)
+    thread = threading.Thread(target=endpoint.serve_forever, daemon=True)
+    thread.start()
+
+    async def run():
+        worker = WebhookWorker(backoff=0.01, **kwargs)
+        worker.start()
+        accepted = [worker.put(endpoint.url, p) for p in payloads]
+        await asyncio.wait_for(worker.queue.join(), 5)
+        worker.stop()
+        return worker, accepted
+
+    try:
+        worker, accepted = asyncio.run(run())
+    finally:
+        endpoint.shutdown()
+        endpoint.server_close()
+    return worker, accepted, endpoint.payloads
+
+
+def test_webhook_delivered(log):
+    worker, accepted, received = deliver([], [{'content': 'a'}, {'content': 'b'}])
+    assert accepted == [True, True]
+    assert received == [{'content': 'a'}, {'content': 'b'}]
+    assert worker.delivered == 2
+    assert worker.stats['max_latency'] > 0
+    assert [e for e, _ in log.events] == ['webhook.ok', 'webhook.ok']
+
+
+def test_webhook_retried(log):
+    worker, _, received = deliver([500, 429], [{'content': 'a'}])
+    assert len(received) == 3
+    assert worker.retried == 2
+    assert worker.delivered == 1
+
+
+def test_webhook_gives_up(log):
+    worker, _, received = deliver([500, 500], [{'content': 'a'}], retries=1)
+    assert len(received) == 2
+    assert worker.failed == 1
+    assert log.events[-1][0] == 'webhook.err'
+
+
+def test_webhook_client_error_not_retried(log):
+    worker, _, received = deliver([404], [{'content': 'a'}])
+    assert len(received) == 1
+    assert worker.failed == 1
+
+
+def test_webhook_dropped_on_overflow(log):
+    worker, accepted, received = deliver(
+        [], [{'content': str(i)} for i in range(3)], queue_size=2)
+    assert accepted == [True, True, False]
+    assert worker.dropped == 1
+    assert len(received) == 2
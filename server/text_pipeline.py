@@ -0,0 +1,109 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import random
+import re
+
+# U+0300 - U+036F - COMBINING DIACRITICAL MARKS
+# U+1AB0 - U+1AFF - COMBINING DIACRITICAL MARKS EXTENDED
+# U+1DC0 - U+1DFF - COMBINING DIACRITICAL MARKS SUPPLEMENT
+# U+20D0 - U+20FF - COMBINING DIACRITICAL MARKS FOR SYMBOLS
+# U+FE20 - U+FE2F - COMBINING HALF MARKS
+COMBINING_MARKS = '[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]'
+
+VOWELS = str.maketrans('', '', 'aeiouAEIOU')
+# Formatting characters and spaces, which do not count towards the length
+# of a message when checking for blankposts
+FORMATTING = str.maketrans('', '', '{}\\`|(~) ')
+WHITESPACE = re.compile(r'\s+')
+
+
+class TextPipeline:
+	"""
+	Sanitizes and transforms chat messages. Patterns are compiled once,
+	when the pipeline is created or its settings change.
+	"""
+
+	def __init__(self, zalgo_tolerance=3):
+		"""
+		:param zalgo_tolerance: number of consecutive combining marks
+		from which they are scrubbed; falsy to keep them all
+		"""
+		self.zalgo = None
+		self.compile(zalgo_tolerance)
+
+	def compile(self, zalgo_tolerance):
+		"""
+		Compile the patterns for the given settings.
+		:param zalgo_tolerance: number of consecutive combining marks
+		from which they are scrubbed; falsy to keep them all
+		"""
+		if zalgo_tolerance:
+			self.zalgo = re.compile(f'{COMBINING_MARKS}{{{int(zalgo_tolerance)},}}')
+		else:
+			self.zalgo = None
+
+	def dezalgo(self, text):
+		"""
+		Turn a string into a de-zalgo'd version, with a tolerance to
+		allow for normal diacritic use.
+		"""
+		if self.zalgo is None:
+			return text
+		return self.zalgo.sub('', text)
+
+	def disemvowel(self, text):
+		"""Remove the vowels of a message and collapse whitespace."""
+		return WHITESPACE.sub(' ', text.translate(VOWELS))
+
+	def shake(self, text):
+		"""Mix the words of a message."""
+		parts = text.split()
+		random.shuffle(parts)
+		return ' '.join(parts)
+
+	def is_spammy(self, text):
+		"""
+		Whether a message has fewer than three characters once
+		formatting and spaces are removed.
+		"""
+		return len(text.translate(FORMATTING)) < 3
+
+	def process(self, text, limit=None, shaken=False, gimp=None,
+			disemvowel=False):
+		"""
+		Run a chat message through every step that applies to it.
+		:param text: message
+		:param limit: maximum length of the message (Default value = None)
+		:param shaken: whether to mix the words (Default value = False)
+		:param gimp: list of messages to replace the message with, or None
+		:param disemvowel: whether to remove vowels (Default value = False)
+		"""
+		if gimp:
+			# The message is replaced anyway, skip scrubbing it
+			text = random.choice(gimp)
+		else:
+			if self.zalgo is not None:
+				text = self.zalgo.sub('', text)
+			if limit is not None:
+				text = text[:limit]
+			if shaken:
+				text = self.shake(text)
+		if disemvowel:
+			text = WHITESPACE.sub(' ', text.translate(VOWELS))
+		return text
@@ -18,7 +18,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import time
-import asyncio
+
+from server.timer_wheel import timers
 
 class Timer:
 
@@ -64,7 +65,7 @@ class Timer:
             ttime = ttime / 60
         if type is 'minutes':
             ttime = ttime / 60
-        asyncio.get_event_loop().call_later(self.alarmtime, lambda: self.resetalarm(client, ttime, type))
+        timers.call_later(self.alarmtime, lambda: self.resetalarm(client, ttime, type))
 
     def resetalarm(self, client, ttime, type):
         self.alarmtime = None
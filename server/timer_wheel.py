@@ -0,0 +1,199 @@
+# tsuserverCC, an Attorney Online server.
+#
+# Copyright (C) 2020 Kaiser <kaiserkaisie@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import math
+
+
+class WheelTimer:
+	"""A callback scheduled on a TimerWheel."""
+	__slots__ = ('wheel', 'deadline', 'tick', 'callback', 'args', 'cancelled')
+
+	def __init__(self, wheel, deadline, callback, args):
+		self.wheel = wheel
+		self.deadline = deadline
+		self.tick = None
+		self.callback = callback
+		self.args = args
+		self.cancelled = False
+
+	def when(self):
+		"""Get the loop time the timer is due at."""
+		return self.deadline
+
+	def cancel(self):
+		"""Cancel the timer. Does nothing if it already fired."""
+		if not self.cancelled:
+			self.cancelled = True
+			self.wheel.remove(self)
+
+	def reschedule(self, delay):
+		"""
+		Move the timer to a new delay from now, re-arming it if it fired
+		or was cancelled. Pushing a pending timer back, such as when a
+		client shows it is alive, is only an assignment: the timer keeps
+		its slot and is moved along when that slot comes up.
+		:param delay: seconds from now
+		"""
+		deadline = self.wheel.time() + max(delay, 0)
+		if self.cancelled:
+			self.cancelled = False
+		elif deadline >= self.deadline and self.tick > self.wheel.tick:
+			self.deadline = deadline
+			return
+		else:
+			self.wheel.remove(self)
+		self.deadline = deadline
+		self.wheel.insert(self)
+
+
+class TimerWheel:
+	"""
+	Hashed timing wheel for coarse timeouts.
+
+	Timers are hashed into a ring of slots by the tick they are due at,
+	and a single loop callback per tick fires every due timer of a slot
+	in one batch. Scheduling, cancelling and rescheduling are O(1) and do
+	not touch the event loop, unlike loop.call_later. Timers fire up to
+	one resolution late.
+	"""
+
+	def __init__(self, resolution=0.25, slots=1024):
+		"""
+		:param resolution: duration of a tick, in seconds
+		:param slots: number of slots in the ring; timers due further
+		than a full turn away stay in their slot for several turns
+		"""
+		self.resolution = resolution
+		self.slots = [set() for _ in range(slots)]
+		self.loop = None
+		self.origin = 0
+		self.tick = 0
+		self.handle = None
+		self.pending = 0
+		# Number of timers fired
+		self.fired = 0
+
+	def __len__(self):
+		"""Get the number of pending timers."""
+		return self.pending
+
+	def time(self):
+		"""Get the current loop time."""
+		if self.loop is None:
+			return asyncio.get_event_loop().time()
+		return self.loop.time()
+
+	def start(self, loop=None):
+		"""
+		Start ticking on an event loop.
+		:param loop: loop to tick on (Default value = the running loop)
+		"""
+		if self.handle is not None:
+			return
+		self.loop = loop if loop is not None else asyncio.get_event_loop()
+		self.origin = self.loop.time()
+		self.tick = 0
+		self.handle = self.loop.call_at(self.origin + self.resolution,
+			self.advance)
+
+	def stop(self):
+		"""Stop ticking and drop every pending timer."""
+		if self.handle is not None:
+			self.handle.cancel()
+			self.handle = None
+		for slot in self.slots:
+			for timer in slot:
+				timer.cancelled = True
+			slot.clear()
+		self.pending = 0
+		self.loop = None
+
+	def call_later(self, delay, callback, *args):
+		"""
+		Schedule a callback, like loop.call_later.
+		:param delay: seconds from now
+		:param callback: function to call
+		:returns: WheelTimer, which can be cancelled or rescheduled
+		"""
+		timer = WheelTimer(self, self.time() + max(delay, 0), callback, args)
+		self.insert(timer)
+		return timer
+
+	def tick_of(self, deadline):
+		"""Get the tick a deadline falls in."""
+		return math.ceil((deadline - self.origin) / self.resolution)
+
+	def insert(self, timer):
+		"""Put a timer in the slot of the tick it is due at."""
+		if self.loop is None:
+			self.start()
+		timer.tick = max(self.tick_of(timer.deadline), self.tick + 1)
+		self.slots[timer.tick % len(self.slots)].add(timer)
+		self.pending += 1
+
+	def remove(self, timer):
+		"""Take a timer out of its slot."""
+		slot = self.slots[timer.tick % len(self.slots)]
+		if timer in slot:
+			slot.remove(timer)
+			self.pending -= 1
+
+	def advance(self):
+		"""Process every tick up to the current time."""
+		# The loop may run a callback up to its clock resolution early
+		target = math.floor(
+			(self.loop.time() - self.origin) / self.resolution + 1e-3)
+		while self.tick < target and self.loop is not None:
+			self.tick += 1
+			self.expire(self.slots[self.tick % len(self.slots)])
+		if self.loop is not None:
+			self.handle = self.loop.call_at(
+				self.origin + (self.tick + 1) * self.resolution, self.advance)
+
+	def expire(self, slot):
+		"""
+		Fire the timers of a slot that are due on the current tick, and
+		move along those that were pushed back.
+		"""
+		due = []
+		for timer in [timer for timer in slot if timer.tick <= self.tick]:
+			slot.remove(timer)
+			self.pending -= 1
+			if self.tick_of(timer.deadline) > self.tick:
+				self.insert(timer)
+			else:
+				due.append(timer)
+		for timer in due:
+			# An earlier callback may have cancelled or rescheduled it
+			if timer.cancelled or timer.tick > self.tick:
+				continue
+			timer.cancelled = True
+			self.fired += 1
+			try:
+				timer.callback(*timer.args)
+			except Exception as exc:
+				self.loop.call_exception_handler({
+					'message': 'Exception in timer wheel callback',
+					'exception': exc,
+				})
+
+
+# Shared by the whole server. It starts ticking on first use.
+timers = TimerWheel()
@@ -22,10 +22,9 @@ import os
 import importlib
 import asyncio
 import hashlib
+import signal
 import websockets
 
-import geoip2.database
-
 import json
 import yaml
 
@@ -36,12 +35,19 @@ from server import database
 from server.area_manager import AreaManager
 from server.client_manager import ClientManager
 from server.musiclist_manager import MusicListManager
+from server.music_catalog import MusicCatalog
+from server.text_pipeline import TextPipeline
+from server.geoip import ASNResolver
 from server.hub_manager import HubManager
+from server.ip_ranges import IPRangeBans
 from server.emotes import Emotes
 from server.exceptions import ClientError,ServerError
 from server.network.aoprotocol import AOProtocol
 from server.network.aoprotocol_ws import new_websocket_client
 from server.network.masterserverclient import MasterServerClient
+from server.network.packet import Packet
+from server.webhooks import WebhookWorker
+from server.timer_wheel import timers
 import server.logger
 
 class TsuServerCC:
@@ -67,23 +73,14 @@ class TsuServerCC:
 		self.char_emotes = None
 		self.char_pages_ao1 = None
 		self.music_list = None
+		self.music_catalog = None
 		self.music_list_ao2 = None
 		self.music_pages_ao1 = None
 		self.backgrounds = None
 		self.zalgo_tolerance = None
-		self.ipRange_bans = []
-		self.geoIpReader = None
-		self.useGeoIp = False
+		self.ipRange_bans = IPRangeBans()
 		self.webperms = []
 
-		try:
-			self.geoIpReader = geoip2.database.Reader('./storage/GeoLite2-ASN.mmdb')
-			self.useGeoIp = True
-			# on debian systems you can use /usr/share/GeoIP/GeoIPASNum.dat if the geoip-database-extra package is installed
-		except FileNotFoundError:
-			self.useGeoIp = False
-			pass
-
 		self.is_poll = False
 		self.poll = ''
 		self.pollyay = []
@@ -91,6 +88,10 @@ class TsuServerCC:
 		self.parties = []
 		self.district_client = None
 		self.ms_client = None
+		self.webhook_worker = None
+		self.event_loop = None
+		self.stopped = None
+		self.tasks = set()
 		self.rp_mode = False
 		self.runner = False
 		self.runtime = 0
@@ -112,50 +113,129 @@ class TsuServerCC:
 				input('(Press Enter to exit)')
 			sys.exit(1)
 
+		self.text_pipeline = TextPipeline(self.config['zalgo_tolerance'])
+
+		self.geoip = ASNResolver('./storage/GeoLite2-ASN.mmdb',
+			cache_size=self.config['geoip_cache_size'],
+			ttl=self.config['geoip_cache_ttl'])
+		# on debian systems you can use /usr/share/GeoIP/GeoIPASNum.dat if the geoip-database-extra package is installed
+		self.geoip.load()
+
 		server.logger.setup_logger(debug=self.config['debug'])
 
 
 	def start(self):
-		"""Start the server."""
-		loop = asyncio.get_event_loop()
+		"""Start the server and run it until interrupted."""
+		self.load_event_loop_policy()
+		try:
+			asyncio.run(self.serve())
+		except KeyboardInterrupt:
+			pass
+
+	def load_event_loop_policy(self):
+		"""
+		Install the event loop policy chosen in the config. uvloop is
+		used if requested and installed, otherwise the stock asyncio loop.
+		"""
+		self.event_loop = 'asyncio'
+		if self.config['event_loop'] == 'uvloop':
+			try:
+				import uvloop
+			except ImportError:
+				logger.debug('uvloop is not installed, using the asyncio event loop.')
+				print('uvloop is not installed, using the asyncio event loop.')
+			else:
+				asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+				self.event_loop = 'uvloop'
+		elif self.config['event_loop'] != 'asyncio':
+			print(f"Unknown event loop {self.config['event_loop']}, using the asyncio event loop.")
+
+	def create_task(self, coro):
+		"""
+		Run a coroutine in the background until the server stops.
+		:param coro: coroutine
+		:returns: created task
+		"""
+		task = asyncio.get_running_loop().create_task(coro)
+		self.tasks.add(task)
+		task.add_done_callback(self.tasks.discard)
+		return task
+
+	async def serve(self):
+		"""Serve clients until the server is stopped."""
+		loop = asyncio.get_running_loop()
+		self.stopped = asyncio.Event()
+		timers.start()
 		bound_ip = '0.0.0.0'
 		if self.config['local']:
 			bound_ip = '127.0.0.1'
 
-		ao_server_crt = loop.create_server(lambda: AOProtocol(self), bound_ip,
-										   self.config['port'])
-		ao_server = loop.run_until_complete(ao_server_crt)
+		ao_server = await loop.create_server(lambda: AOProtocol(self),
+											 bound_ip, self.config['port'])
 
+		ao_server_ws = None
 		if self.config['use_websockets']:
-			ao_server_ws = websockets.serve(new_websocket_client(self),
-											bound_ip,
-											self.config['websocket_port'])
-			asyncio.ensure_future(ao_server_ws)
+			ao_server_ws = await websockets.serve(new_websocket_client(self),
+												  bound_ip,
+												  self.config['websocket_port'])
 
 		if self.config['use_masterserver']:
 			self.ms_client = MasterServerClient(self)
-			asyncio.ensure_future(self.ms_client.connect(), loop=loop)
+			self.create_task(self.ms_client.connect())
 
 		if self.config['zalgo_tolerance']:
 			self.zalgo_tolerance = self.config['zalgo_tolerance']
 
-		asyncio.ensure_future(self.schedule_unbans())
+		self.create_task(self.schedule_unbans())
+
+		self.webhook_worker = WebhookWorker(
+			queue_size=self.config['webhook_queue_size'],
+			retries=self.config['webhook_retries'])
+		self.webhook_worker.start()
 
+		database.writer.interval = self.config['db_flush_interval'] / 1000
+		database.writer.batch_size = self.config['db_flush_rows']
 		database.log_misc('start')
-		print('Server started and is listening on port {}'.format(
-			self.config['port']))
+		print('Server started and is listening on port {} ({} event loop)'.format(
+			self.config['port'], self.event_loop))
 
-		try:
-			loop.run_forever()
-		except KeyboardInterrupt:
-			pass
+		for sig in (signal.SIGINT, signal.SIGTERM):
+			try:
+				loop.add_signal_handler(sig, self.stop)
+			except NotImplementedError:
+				# Windows: Ctrl+C cancels this task instead
+				pass
 
-		database.log_misc('stop')
+		try:
+			await self.stopped.wait()
+		finally:
+			# Also reached when the loop cancels this task on Ctrl+C
+			ao_server.close()
+			if ao_server_ws is not None:
+				ao_server_ws.close()
+			# wait_closed waits for every connection since Python 3.12
+			for client in list(self.client_manager.clients):
+				client.disconnect()
+			await ao_server.wait_closed()
+			if ao_server_ws is not None:
+				await ao_server_ws.wait_closed()
+
+			tasks = list(self.tasks)
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+
+			timers.stop()
+			self.geoip.close()
+			self.webhook_worker.stop()
+			database.log_misc('stop')
+			database.writer.stop()
+
+	def stop(self):
+		"""Stop serving clients and shut the server down cleanly."""
+		if self.stopped is not None:
+			self.stopped.set()
 
-		ao_server.close()
-		loop.run_until_complete(ao_server.wait_closed())
-		loop.close()
-		
 	def get_version_string(self):
 		return str(self.release) + '.' + str(self.major_version) + '.' + str(self.minor_version)
 
@@ -181,33 +261,44 @@ class TsuServerCC:
 		"""
 		peername = transport.get_extra_info('peername')[0]
 
-		if self.useGeoIp:
-			try:
-				geoIpResponse = self.geoIpReader.asn(peername)
-				asn = str(geoIpResponse.autonomous_system_number)
-			except geoip2.errors.AddressNotFoundError:
-				asn = "Loopback"
-				pass
+		if self.config['geoip_executor']:
+			# Resolved in the background on a miss, see check_asn
+			asn = self.geoip.get_cached(peername)
 		else:
-			asn = "Loopback"
+			asn = self.geoip.lookup(peername)
 
-		for line,rangeBan in enumerate(self.ipRange_bans):
-			if rangeBan != "" and peername.startswith(rangeBan) or asn == rangeBan:
-				msg =   'BD#'
-				msg +=  'Abuse\r\n'
-				msg += f'ID: {line}\r\n'
-				msg +=  'Until: N/A'
-				msg +=  '#%'
+		line = self.ipRange_bans.match(peername, asn)
+		if line is not None:
+			msg =   'BD#'
+			msg +=  'Abuse\r\n'
+			msg += f'ID: {line}\r\n'
+			msg +=  'Until: N/A'
+			msg +=  '#%'
 
-				transport.write(msg.encode('utf-8'))
-				raise ClientError
+			transport.write(msg.encode('utf-8'))
+			raise ClientError
 
 		c = self.client_manager.new_client(transport)
 		c.server = self
 		c.area = self.area_manager.default_area()
 		c.area.new_client(c)
+		if asn is None:
+			self.create_task(self.check_asn(c, peername))
 		return c
 
+	async def check_asn(self, client, ip):
+		"""
+		Resolve the ASN of a client off the event loop, after it missed
+		the cache, and drop the client if that ASN is banned.
+		:param client: client object
+		:param ip: IP address of the client
+		"""
+		asn = await self.geoip.resolve_async(ip)
+		line = self.ipRange_bans.match(ip, asn)
+		if line is not None and client in self.client_manager.clients:
+			client.send_command('BD', f'Abuse\r\nID: {line}\r\nUntil: N/A')
+			client.disconnect()
+
 	def remove_client(self, client):
 		"""
 		Remove a disconnected client.
@@ -250,12 +341,36 @@ class TsuServerCC:
 		if 'webhook_url' not in self.config:
 			self.config['webhook_url'] = "example.com"
 		
+		if 'webhook_queue_size' not in self.config:
+			self.config['webhook_queue_size'] = 100
+
+		if 'webhook_retries' not in self.config:
+			self.config['webhook_retries'] = 3
+
 		if 'ooc_delay' not in self.config:
 			self.config['ooc_delay'] = 0
 			
 		if 'asset_url' not in self.config:
 			self.config['asset_url'] = ''
 
+		if 'db_flush_interval' not in self.config:
+			self.config['db_flush_interval'] = 250
+
+		if 'db_flush_rows' not in self.config:
+			self.config['db_flush_rows'] = 128
+
+		if 'event_loop' not in self.config:
+			self.config['event_loop'] = 'asyncio'
+
+		if 'geoip_cache_size' not in self.config:
+			self.config['geoip_cache_size'] = 4096
+
+		if 'geoip_cache_ttl' not in self.config:
+			self.config['geoip_cache_ttl'] = 3600
+
+		if 'geoip_executor' not in self.config:
+			self.config['geoip_executor'] = False
+
 		#if isinstance(self.config['modpass'], str):
 		#	self.config['modpass'] = {'default': {'password': self.config['modpass']}}
 
@@ -265,11 +380,13 @@ class TsuServerCC:
 			self.char_list = yaml.safe_load(chars)
 		self.build_char_pages_ao1()
 		self.char_emotes = {char: Emotes(char) for char in self.char_list}
+		self.client_manager.reindex_char_names()
 
 	def load_music(self):
 		"""Load the music list from a YAML file."""
 		with open('config/music.yaml', 'r', encoding='utf-8') as music:
 			self.music_list = yaml.safe_load(music)
+		self.music_catalog = MusicCatalog(self.music_list)
 		self.build_music_pages_ao1()
 		self.build_music_list_ao2()
 		
@@ -301,9 +418,7 @@ class TsuServerCC:
 	def load_ipranges(self):
 		"""Load a list of banned IP ranges."""
 		try:
-			with open('config/iprange_ban.txt', 'r',
-					  encoding='utf-8') as ipranges:
-				self.ipRange_bans = ipranges.read().splitlines()
+			self.ipRange_bans = IPRangeBans.load('config/iprange_ban.txt')
 		except:
 			logger.debug('Cannot find iprange_ban.txt')
 
@@ -395,42 +510,26 @@ class TsuServerCC:
 		"""
 		Get information about a track, if exists.
 		:param music: track name
-		:returns: tuple (name, length or -1)
+		:param area: area whose custom music list is also searched
+		:returns: tuple (name, length, mod, custom)
 		:raises: ServerError if track not found
 		"""
-		for item in self.music_list:
-			if item['category'] == music:
-				return item['category'], 0, -1, False
-			for song in item['songs']:
-				if song['name'] == music:
-					try:
-						return song['name'], song['length'], song['mod']
-					except KeyError:
-						try:
-							return song['name'], song['length'], -1, False
-						except KeyError:
-							return song['name'], 0, -1, False
-		if len(area.cmusic_list) != 0:
-			for item in area.cmusic_list:
-				if item['category'] == music:
-					return item['category'], 0, -1, True
-				if len(item['songs']) != 0:
-					for song in item['songs']:
-						if song['name'] == music:
-							try:
-								return song['name'], song['length'], song['mod'], True
-							except KeyError:
-								return song['name'], song['length'], -1, True
-		raise ServerError('Music not found.')
+		track = self.music_catalog.get(music)
+		if track is None:
+			track = area.cmusic_catalog.get(music)
+		if track is None:
+			raise ServerError('Music not found.')
+		return track.name, track.length, track.mod, track.custom
 
 	def send_all_cmd_pred(self, cmd, *args, pred=lambda x: True):
 		"""
 		Broadcast an AO-compatible command to all clients that satisfy
 		a predicate.
 		"""
+		packet = Packet(cmd, *args)
 		for client in self.client_manager.clients:
 			if pred(client):
-				client.send_command(cmd, *args)
+				client.send_packet(packet)
 
 	def broadcast_global(self, client, msg, as_mod=False):
 		"""
@@ -611,6 +710,10 @@ class TsuServerCC:
 		with open('config/config.yaml', 'r') as cfg:
 			cfg_yaml = yaml.safe_load(cfg)
 			self.config['motd'] = cfg_yaml['motd'].replace('\\n', ' \n')
+			if 'zalgo_tolerance' in cfg_yaml:
+				self.config['zalgo_tolerance'] = cfg_yaml['zalgo_tolerance']
+				self.zalgo_tolerance = self.config['zalgo_tolerance']
+			self.text_pipeline.compile(self.config['zalgo_tolerance'])
 
 			# Reload moderator passwords list and unmod any moderator affected by
 			# credential changes or removals
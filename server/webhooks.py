@@ -17,15 +17,149 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import os
+import asyncio
 import logging
 import yaml
-from time import localtime, strftime
+from concurrent.futures import ThreadPoolExecutor
+from time import localtime, strftime, monotonic
 
 import requests
 import json
 
 from server import database
 
+logger = logging.getLogger('debug')
+
+
+class WebhookWorker:
+	"""
+	Delivers webhook payloads in the background, so that a slow or
+	unreachable endpoint never blocks the event loop.
+
+	Payloads are posted one at a time, in order, over a keep-alive
+	session on a dedicated thread. Failed deliveries are retried with
+	exponential backoff; if the queue is full, new payloads are dropped.
+	"""
+
+	def __init__(self, queue_size=100, retries=3, backoff=1.0, timeout=10):
+		"""
+		:param queue_size: maximum number of undelivered payloads
+		:param retries: number of retries after a failed delivery
+		:param backoff: delay before the first retry, in seconds
+		:param timeout: HTTP timeout, in seconds
+		"""
+		self.queue = asyncio.Queue(maxsize=queue_size)
+		self.retries = retries
+		self.backoff = backoff
+		self.timeout = timeout
+		self.session = requests.Session()
+		self.session.headers['Content-Type'] = 'application/json'
+		self.executor = ThreadPoolExecutor(max_workers=1,
+			thread_name_prefix='webhook')
+		self.task = None
+
+		self.enqueued = 0
+		self.delivered = 0
+		self.failed = 0
+		self.dropped = 0
+		self.retried = 0
+		self.last_latency = 0
+		self.max_latency = 0
+		self.total_latency = 0
+
+	def start(self):
+		"""Start delivering queued payloads."""
+		if self.task is None:
+			self.task = asyncio.ensure_future(self.run())
+
+	def stop(self):
+		"""Stop delivering and close the HTTP session."""
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+		self.executor.shutdown(wait=False)
+		self.session.close()
+		logger.debug(f'Webhook worker stopped: {self.stats}')
+
+	def put(self, url, data):
+		"""
+		Queue a payload for delivery.
+		:param url: webhook URL
+		:param data: JSON-serializable payload
+		:returns: False if the payload was dropped because the queue is full
+		"""
+		try:
+			self.queue.put_nowait((url, data))
+		except asyncio.QueueFull:
+			self.dropped += 1
+			logger.debug(f'Dropped webhook payload: {data}')
+			return False
+		self.enqueued += 1
+		return True
+
+	@property
+	def stats(self):
+		delivered = max(self.delivered, 1)
+		return {
+			'pending': self.queue.qsize(),
+			'enqueued': self.enqueued,
+			'delivered': self.delivered,
+			'failed': self.failed,
+			'dropped': self.dropped,
+			'retried': self.retried,
+			'last_latency': self.last_latency,
+			'avg_latency': self.total_latency / delivered,
+			'max_latency': self.max_latency
+		}
+
+	async def run(self):
+		loop = asyncio.get_event_loop()
+		while True:
+			url, data = await self.queue.get()
+			try:
+				await self.deliver(loop, url, data)
+			finally:
+				self.queue.task_done()
+
+	async def deliver(self, loop, url, data):
+		"""
+		Post a payload, retrying on connection errors, rate limits and
+		server errors.
+		"""
+		body = json.dumps(data)
+		start = monotonic()
+		for attempt in range(self.retries + 1):
+			if attempt > 0:
+				self.retried += 1
+				await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+			try:
+				result = await loop.run_in_executor(self.executor, self.post,
+					url, body)
+			except requests.exceptions.RequestException as err:
+				error = err
+				continue
+			if result.status_code == 429 or result.status_code >= 500:
+				error = f'HTTP {result.status_code}'
+				continue
+			try:
+				result.raise_for_status()
+			except requests.exceptions.HTTPError as err:
+				error = err
+				break
+			latency = monotonic() - start
+			self.delivered += 1
+			self.last_latency = latency
+			self.total_latency += latency
+			self.max_latency = max(self.max_latency, latency)
+			database.log_misc('webhook.ok', data="successfully delivered payload, code {} in {:.0f} ms".format(result.status_code, latency * 1000))
+			return
+		self.failed += 1
+		database.log_misc('webhook.err', data=str(error))
+
+	def post(self, url, body):
+		"""Post a payload. Runs on the worker thread."""
+		return self.session.post(url, data=body, timeout=self.timeout)
+
 
 class Webhooks:
 	"""
@@ -49,13 +183,7 @@ class Webhooks:
 			embed["description"] = description
 			embed["title"] = title
 			data["embeds"].append(embed)
-		result = requests.post(url, data=json.dumps(data), headers={"Content-Type": "application/json"})
-		try:
-			result.raise_for_status()
-		except requests.exceptions.HTTPError as err:
-			database.log_misc('webhook.err', data=err)
-		else:
-			database.log_misc('webhook.ok', data="successfully delivered payload, code {}".format(result.status_code))
+		self.server.webhook_worker.put(url, data)
 	def modcall(self, char, ipid, area, reason=None):
 		is_enabled = self.server.config['modcall_webhook']['enabled']
 		username = self.server.config['modcall_webhook']['username']